@@ -16,10 +16,69 @@ generator
 """
 
 class SpriteMap(list):
+    """The sprites of spritemap *fname*, in order of first appearance and
+    each only once.
+
+    A set of the sprites is kept alongside the list, so adding to and
+    looking up in a spritemap takes constant time.
+    """
+
     def __init__(self, fname, L=[] ,position=[0,0]):
         self.fname = fname
         self.position = position
-        super(SpriteMap, self).__init__(L)
+        super(SpriteMap, self).__init__()
+        self._index = set()
+        self.extend(L)
+
+    def __contains__(self, sref):
+        return sref in self._index
+
+    def add(self, sref):
+        """Add *sref* unless already there; return whether it was added."""
+        if sref in self._index:
+            return False
+        self._index.add(sref)
+        list.append(self, sref)
+        return True
+
+    def append(self, sref):
+        self.add(sref)
+
+    def extend(self, srefs):
+        for sref in srefs:
+            self.add(sref)
+
+    def __iadd__(self, srefs):
+        self.extend(srefs)
+        return self
+
+    def __reduce__(self):
+        # the index is made anew from the list, not copied or pickled
+        return (type(self), (self.fname, list(self), self.position))
+
+    def _reindexing(name):
+        method = getattr(list, name)
+        def reindexing(self, *args):
+            saved = list(self)
+            rv = method(self, *args)
+            index = set(self)
+            if len(index) != len(self):
+                list.__setitem__(self, slice(None), saved)
+                raise ValueError("duplicate sprites in %r" % (self.fname,))
+            self._index = index
+            return rv
+        reindexing.__name__ = name
+        return reindexing
+
+    # less common changes just index the list all over
+    insert = _reindexing("insert")
+    remove = _reindexing("remove")
+    pop = _reindexing("pop")
+    __setitem__ = _reindexing("__setitem__")
+    __delitem__ = _reindexing("__delitem__")
+    __setslice__ = _reindexing("__setslice__")
+    __delslice__ = _reindexing("__delslice__")
+    del _reindexing
 
     def __hash__(self):
         return hash(self.fname)
@@ -32,13 +91,21 @@ class SpriteMap(list):
 class SpriteRef(object):
     """Reference to a sprite, existent or not."""
 
-    def __init__(self, fname, source, position=[ '0px' , '0px' ]):
+    __slots__ = ("fname", "source", "position")
+
+    def __init__(self, fname, source, position=None):
         self.fname = fname
         self.source = source
-        if position == []:
+        if not position:
             position = [ '0px' , '0px' ]
         self.position = position
 
+    def __getstate__(self):
+        return (self.fname, self.source, self.position)
+
+    def __setstate__(self, state):
+        (self.fname, self.source, self.position) = state
+
     def __str__(self):
         return self.fname
 
@@ -54,6 +121,8 @@ class SpriteRef(object):
         return NotImplemented
 
 class MappedSpriteRef(SpriteRef):
+    __slots__ = ()
+
     def __init__(self, fname, source, pos):
         super(MappedSpriteRef, self).__init__(fname, source)
         self.position = pos
@@ -0,0 +1,208 @@
+"""On-disk caches of build results
+
+`FileCache` is a directory of files named by key. Hits touch the file, and
+`FileCache.evict` removes the least recently used files until the directory
+fits in its size budget.
+
+`ParseCache` keeps what a build needs from a parsed stylesheet: its config
+statements, sprite references and events, keyed by a hash of the
+stylesheet's contents and `parse_version`.
+
+`SpriteCache` keeps decoded sprites as raw RGBA rows, which are read straight
+back on a hit. Both can share one directory, and so one size budget.
+"""
+
+import os
+import errno
+import struct
+import marshal
+import hashlib
+import logging
+import tempfile
+from os import path
+from array import array
+
+from . import SpriteRef
+from .config import CSSConfig
+from .finder import ScannedCSS
+from .css.store import EventStore
+from .image import RawPixels
+
+logger = logging.getLogger(__name__)
+
+#: bump whenever tokenizing, parsing or finding sprites gives other results
+parse_version = 2
+#: bump whenever decoding sprites gives other results
+sprite_version = 1
+
+class FileCache(object):
+    """Files under *dirname*, at most *max_size* bytes in all after
+    eviction.
+    """
+
+    def __init__(self, dirname, max_size=256 << 20):
+        self.dirname = dirname
+        self.max_size = max_size
+
+    def __repr__(self):
+        return "%s(%r, max_size=%r)" % (type(self).__name__,
+                                        self.dirname, self.max_size)
+
+    def path(self, key):
+        return path.join(self.dirname, key)
+
+    def get(self, key):
+        """Return the data stored at *key*, or None."""
+        fname = self.path(key)
+        try:
+            with open(fname, "rb") as fp:
+                data = fp.read()
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        self.touch(fname)
+        return data
+
+    def touch(self, fname):
+        try:
+            os.utime(fname, None)
+        except OSError:
+            pass
+
+    def put(self, key, data):
+        """Store *data* at *key*, atomically replacing any previous entry."""
+        if not path.isdir(self.dirname):
+            try:
+                os.makedirs(self.dirname)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+        (fd, tmp_fname) = tempfile.mkstemp(dir=self.dirname, prefix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(data)
+            os.rename(tmp_fname, self.path(key))
+        except:
+            os.unlink(tmp_fname)
+            raise
+
+    def iter_entries(self):
+        """Yield (mtime, size, filename) of each entry."""
+        if not path.isdir(self.dirname):
+            return
+        for name in os.listdir(self.dirname):
+            if name.startswith("."):
+                continue
+            fname = self.path(name)
+            try:
+                st = os.stat(fname)
+            except OSError:
+                continue
+            yield (st.st_mtime, st.st_size, fname)
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is no
+        larger than `max_size`.
+        """
+        entries = sorted(self.iter_entries())
+        total = sum(size for (mtime, size, fname) in entries)
+        for (mtime, size, fname) in entries:
+            if total <= self.max_size:
+                break
+            logger.debug("evicting %s from cache", fname)
+            try:
+                os.unlink(fname)
+            except OSError:
+                continue
+            total -= size
+
+class ParseCache(FileCache):
+    """Cache of `ScannedCSS` results by stylesheet contents.
+
+    Sprite references are stored as written and resolved on loading, so
+    the same contents can be found again under another name.
+    """
+
+    def key(self, data):
+        digest = hashlib.sha1(data).hexdigest()
+        return "css-%d-%s" % (parse_version, digest)
+
+    def load(self, data, fname, base=None):
+        """Restore the scan of stylesheet *data* at *fname*, or None."""
+        entry = self.get(self.key(data))
+        if entry is None:
+            return None
+        try:
+            (version, stmts, urls, columns, texts) = marshal.loads(entry)
+        except (ValueError, EOFError, TypeError):
+            logger.warn("%s: corrupt parse cache entry", fname)
+            return None
+        if version != parse_version:
+            return None
+        conf = CSSConfig(base=base, fname=fname)
+        conf.update(stmts)
+        srefs = [SpriteRef(conf.normpath(url), source=fname) for url in urls]
+        columns = [array(tc, col) for (tc, col) in columns]
+        store = EventStore(data, *(columns + [texts]))
+        return ScannedCSS(conf, srefs, events=store, stmts=stmts, urls=urls)
+
+    def save(self, data, fname, scanned):
+        """Store *scanned*, the scan of stylesheet *data* at *fname*."""
+        store = scanned.events
+        columns = [(col.typecode, col.tostring())
+                   for col in store.columns[:-1]]
+        entry = (parse_version, list(scanned.stmts), list(scanned.urls),
+                 columns, store.texts)
+        self.put(self.key(data), marshal.dumps(entry))
+
+_header_len = struct.Struct("!I")
+
+class SpriteCache(FileCache):
+    """Cache of decoded sprites by path, size, modification time and
+    contents.
+
+    An entry is the length of a marshalled (version, width, height, meta)
+    header, the header, and the rows of pixels.
+    """
+
+    def key(self, fname, data):
+        mtime = os.stat(fname).st_mtime
+        h = hashlib.sha1("%s\0%d\0%r\0" % (path.abspath(fname), len(data),
+                                            mtime))
+        h.update(data)
+        return "rgba-%d-%s" % (sprite_version, h.hexdigest())
+
+    def load(self, fname, data):
+        """Return (width, height, pixels, meta) of sprite *data* at *fname*,
+        the pixels read from the cache, or None.
+        """
+        buf = self.get(self.key(fname, data))
+        if buf is None:
+            return None
+        try:
+            (size,) = _header_len.unpack(buf[:_header_len.size])
+            offset = _header_len.size + size
+            header = buf[_header_len.size:offset]
+            (version, width, height, meta) = marshal.loads(header)
+        except (struct.error, ValueError, EOFError, TypeError):
+            logger.warn("%s: corrupt sprite cache entry", fname)
+            return None
+        if version != sprite_version:
+            return None
+        pixels = RawPixels(buf, width, height, "BH"[meta["bitdepth"] > 8],
+                           offset=offset)
+        if len(buf) != offset + pixels.row_size * height:
+            logger.warn("%s: corrupt sprite cache entry", fname)
+            return None
+        return (width, height, pixels, meta)
+
+    def save(self, fname, data, decoded):
+        """Store *decoded*, the (width, height, rows, meta) of sprite *data*
+        at *fname*.
+        """
+        (width, height, rows, meta) = decoded
+        header = marshal.dumps((sprite_version, width, height, meta))
+        parts = [_header_len.pack(len(header)), header]
+        parts.extend(row.tostring() for row in rows)
+        self.put(self.key(fname, data), "".join(parts))
@@ -1,8 +1,10 @@
+import re
 import shlex
 from os import path
 from itertools import imap, ifilter
 from urlparse import urljoin
-from .css import CSSParser, iter_events
+from .css import iter_events
+from .css.parser import string_pattern
 
 def parse_config_stmt(line, prefix="spritemapper."):
     line = line.strip()
@@ -18,6 +20,27 @@ def iter_css_config(parser):
         for v in iter_config_stmts(ev.comment):
             yield v
 
+# strings are matched only to be skipped; unlike `comment_pattern`, this
+# leaves out a comment that isn't closed
+_comment_re = re.compile(r"%s|/\*(.*?)\*/" % (string_pattern,), re.S)
+
+def iter_comments(data):
+    """Yield the text of every comment in raw stylesheet *data*."""
+    for mo in _comment_re.finditer(data):
+        comment = mo.group(1)
+        if comment is not None:
+            yield comment
+
+def iter_css_config_data(data, prefix="spritemapper."):
+    """Like `iter_css_config`, but scans raw stylesheet *data* (a string or
+    a memory map) for comments instead of parsing it.
+    """
+    if data.find(prefix) < 0:
+        return
+    for comment in iter_comments(data):
+        for v in iter_config_stmts(comment):
+            yield v
+
 class CSSConfig(object):
     def __init__(self, parser=None, base=None, root=None, fname=None):
         if fname and root is None:
@@ -31,10 +54,22 @@ class CSSConfig(object):
         # this is mostly so you can go CSSConfig(base=CSSConfig(..))
         return self._data.iteritems()
 
+    def update(self, stmts):
+        """Apply (key, value) statements *stmts* on top of the current
+        configuration."""
+        self._data.update(stmts)
+
+    @classmethod
+    def from_data(cls, data, base=None, fname=None):
+        """Configure from the comments in raw stylesheet *data*."""
+        self = cls(base=base, fname=fname)
+        self.update(iter_css_config_data(data))
+        return self
+
     @classmethod
-    def from_file(cls, fname):
+    def from_file(cls, fname, base=None):
         with open(fname, "rb") as fp:
-            return cls(CSSParser.from_file(fp), fname=fname)
+            return cls.from_data(fp.read(), base=base, fname=fname)
 
     def normpath(self, p):
         """Normalize a possibly relative path *p* to the root."""
@@ -108,11 +143,10 @@ class CSSConfig(object):
 
 def print_config(fname):
     from pprint import pprint
-    from .css import CSSParser
 
     with open(fname, "rb") as fp:
         print "%s\n%s\n" % (fname, "=" * len(fname))
-        pprint(dict(iter_css_config(CSSParser.read_file(fp))))
+        pprint(dict(iter_css_config_data(fp.read())))
         print
 
 def main():
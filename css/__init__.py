@@ -5,11 +5,12 @@
 # Part of Spritemapper (https://github.com/yostudios/Spritemapper)
 # Released under a MIT/X11 license
 
-from .parser import CSSParser, print_css
+from .parser import CSSParser, print_css, splice_css
+from .store import EventStore
 from itertools import ifilter, imap
 
-__all__ = ["CSSParser", "iter_events", "split_declaration",
-           "print_css", "iter_declarations"]
+__all__ = ["CSSParser", "EventStore", "iter_events", "split_declaration",
+           "print_css", "splice_css", "iter_declarations"]
 
 def iter_events(parser, lexemes=None, predicate=None):
     if lexemes and predicate:
@@ -0,0 +1,63 @@
+"""Throughput measurements for the CSS tokenizer engines and parser
+
+Run as ``python -m spritecss.css.bench <css file(s) ...>``; every engine in
+`spritecss.css.parser.tokenizers` tokenizes each file, then the parser turns
+it into events, and the best of a few rounds is reported.
+"""
+
+import sys
+import time
+from collections import deque
+
+from .parser import CSSParser, css_tokenize, tokenizers, default_tokenizer
+
+def _best_time(func, repeat):
+    best = None
+    for i in xrange(repeat):
+        t0 = time.time()
+        rv = func()
+        dt = time.time() - t0
+        if best is None or dt < best:
+            best = dt
+    return (rv, best)
+
+def bench_tokenizer(data, tokenizer, chunk_size=8192, repeat=3):
+    """Tokenize *data* with *tokenizer*, return (num tokens, seconds)."""
+    def run():
+        chunks = (data[i:i + chunk_size]
+                  for i in xrange(0, len(data), chunk_size))
+        counter = deque(enumerate(css_tokenize(chunks, tokenizer)), 1)
+        return counter[0][0] + 1 if counter else 0
+    return _best_time(run, repeat)
+
+def bench_parser(data, tokenizer=None, repeat=3):
+    """Parse *data* into events, return (num events, seconds)."""
+    def run():
+        evs = CSSParser(data=data, tokenizer=tokenizer)
+        counter = deque(enumerate(evs), 1)
+        return counter[0][0] + 1 if counter else 0
+    return _best_time(run, repeat)
+
+def print_bench(fname, data, results, out=sys.stdout):
+    """Print *results*, a list of (name, unit, (num units, seconds)).
+    """
+    size_mb = len(data) / float(1 << 20)
+    print >>out, "%s (%.2f MB)" % (fname, size_mb)
+    for (name, unit, (num, secs)) in results:
+        secs = max(secs, 1e-9)
+        args = (name, num, unit, secs, num / secs, unit, size_mb / secs)
+        print >>out, ("  %-10s %9d %s in %.3fs "
+                      "(%.0f %s/s, %.2f MB/s)" % args)
+
+def main():
+    for fname in sys.argv[1:]:
+        with open(fname, "rb") as fp:
+            data = fp.read()
+        results = [(name, "tokens", bench_tokenizer(data, name))
+                   for name in sorted(tokenizers)]
+        results.append(("parser", "events",
+                        bench_parser(data, default_tokenizer)))
+        print_bench(fname, data, results)
+
+if __name__ == "__main__":
+    main()
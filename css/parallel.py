@@ -0,0 +1,93 @@
+"""Splitting stylesheets for parsing in parallel
+
+A stylesheet can be cut right after any top-level block end (a ``}`` that
+closes every block opened before it, and isn't in a string or a comment)
+and the pieces parsed independently: the parser is back in its initial
+state at every such point. Each piece is tokenized knowing its offset and
+line number in the whole, so the events of all pieces simply follow one
+another.
+"""
+
+import re
+
+from .parser import (CSSParser, CSSParseState, CSSScanner, string_pattern,
+                     comment_pattern)
+from .store import EventStore
+
+#: default size of the segments to parse in parallel
+segment_size = 1 << 20
+
+_block_re = re.compile(r"%s|%s|[{}]" % (string_pattern, comment_pattern),
+                       re.S)
+
+def iter_split_points(data, pos=0, end=None):
+    """Yield the offset right after each top-level block end in *data*."""
+    if end is None:
+        end = len(data)
+    depth = 0
+    for mo in _block_re.finditer(data, pos, end):
+        tok = mo.group()
+        if tok == "{":
+            depth += 1
+        elif tok == "}" and depth:
+            depth -= 1
+            if not depth:
+                yield mo.end()
+
+def split_segments(data, size=segment_size):
+    """Cut *data* into (start, end) segments of at least *size* bytes, bar
+    the last one, at top-level block ends.
+    """
+    segments = []
+    start = 0
+    for point in iter_split_points(data):
+        if point - start >= size:
+            segments.append((start, point))
+            start = point
+    if start < len(data) or not segments:
+        segments.append((start, len(data)))
+    return segments
+
+def iter_segment_texts(data, segments):
+    """Yield (text, start, line number, column) of each segment."""
+    line_no = 1
+    line_start = 0
+    for (start, end) in segments:
+        text = data[start:end]
+        yield (text, start, line_no, start - line_start + 1)
+        nl = text.count("\n")
+        if nl:
+            line_no += nl
+            line_start = start + text.rfind("\n") + 1
+
+def parse_segment(text, start, line_no=1, col_no=1):
+    """Parse *text*, a segment beginning at offset *start* and *line_no* in
+    its stylesheet, into events spanning offsets of the stylesheet.
+    """
+    toks = CSSScanner(start, line_no, col_no).tokenize_buffer(text)
+    return CSSParser(CSSParseState(toks))
+
+def _parse_segment_job(args):
+    return EventStore.from_events(parse_segment(*args), None).columns
+
+def merge_columns(store, columns):
+    """Append the events of *columns* (as per `EventStore.columns`) to
+    *store*.
+    """
+    (codes, starts, ends, lines, texts) = columns
+    base = len(store)
+    store.codes.extend(codes)
+    store.starts.extend(starts)
+    store.ends.extend(ends)
+    store.lines.extend(lines)
+    for (idx, text) in texts.iteritems():
+        store.texts[base + idx] = text
+    return store
+
+def parse_parallel(data, pool, size=segment_size):
+    """Parse *data* in segments on the worker *pool* into an `EventStore`."""
+    segments = iter_segment_texts(data, split_segments(data, size))
+    store = EventStore(data)
+    for columns in pool.imap(_parse_segment_job, segments):
+        merge_columns(store, columns)
+    return store
@@ -19,6 +19,7 @@ following lexemes:
 
 import sys
 import re
+import mmap
 from itertools import imap
 from collections import deque
 
@@ -31,11 +32,6 @@ class EventStream(object):
         if events is None:
             events = deque()
         self._events = events
-        self._event = None
-
-    def next(self):
-        self._event = event = self._events.popleft()
-        return event
 
     def iter_events(self):
         while True:
@@ -48,14 +44,6 @@ class EventStream(object):
     def push(self, event):
         self._events.append(event)
 
-class OutOfTokens(Exception):
-    """A lot like StopIteration: signals that the end of the input token stream
-    has been reached.
-
-    This is chiefly so that the for loops in _handle_* are exited and bubble up
-    to `CSSParser._eval_once`.
-    """
-
 class Token(object):
     """A token from CSS code. Lexeme definitions:
 
@@ -86,13 +74,15 @@ class Token(object):
     "dumb" means "lexed as such without consideration for surrounding context"
     """
 
-    __slots__ = ("lexeme", "value", "line_no", "col_no")
+    __slots__ = ("lexeme", "value", "line_no", "col_no", "offset")
 
-    def __init__(self, lexeme="char", value=None, line_no=None, col_no=None):
+    def __init__(self, lexeme="char", value=None, line_no=None, col_no=None,
+                 offset=None):
         self.lexeme = lexeme
         self.value = value
         self.line_no = line_no
         self.col_no = col_no
+        self.offset = offset
 
     def __repr__(self):
         clsname = type(self).__name__
@@ -204,65 +194,190 @@ def _css_tokenizer_lineno(toks):
     """Tokenize and count line numbers. Yields states."""
     col_no = 1
     line_no = 1
+    offset = 0
     for tok in toks:
         tok.line_no = line_no
         tok.col_no = col_no
+        tok.offset = offset
         yield tok
+        if tok.value:
+            offset += len(tok.value)
         if tok.lexeme == "w" and tok.value == "\n":
             col_no = 1
             line_no += 1
         else:
             col_no += 1
 
-def css_tokenize(it):
+def css_tokenize_charwise(it):
+    """Tokenize chunks one character at a time (the original engine.)"""
     return _css_tokenizer_lineno(_css_tokenizer_lvl1(_bytestream(it)))
 
-def css_tokenize_data(css):
-    return css_tokenize([css])
+# Patterns of a quoted string and a comment, either of which may be cut off
+# by the end of input (use re.S). Scanners of raw stylesheets match these
+# only so that what's in them is skipped.
+string_pattern = r"""(?:"(?:[^"\\]|\\.?)*"?|'(?:[^'\\]|\\.?)*'?)"""
+comment_pattern = r"/\*.*?(?:\*/|\Z)"
+
+# an inline data: URI is one opaque "char" token, semicolons and all; the
+# "char" pattern stops short of one so that it's matched from its start
+_scan_re = re.compile(r"""
+    (?P<w>\s+)
+  | (?P<data_uri>url\((?:"data:[^"]*"?|'data:[^']*'?|data:[^)]*)\s*\)?)
+  | (?P<char>(?:[^\s{};@"'/u]|/(?!\*)|u(?!rl\(["']?data:))+)
+  | (?P<quote>%s)
+  | (?P<comment_begin>/\*)
+  | (?P<block_begin>\{)
+  | (?P<block_end>\})
+  | (?P<semicolon>;)
+  | (?P<at>@)
+""" % (string_pattern,), re.X | re.S)
+
+#: how far past the end of a token `_scan_re` may have to look
+_scan_lookahead = len("url('data:")
+
+class CSSScanner(object):
+    """Tokenizer that scans whole buffers with a compiled pattern.
+
+    Emits the same lexemes as the character-wise engine, but contiguous runs
+    are emitted as one token: words, quoted strings and ``url(data:...)``
+    as a single "char", whitespace as a single "w", and a comment as
+    "comment_begin", its body as one "char" and "comment_end".
+
+    Token offsets are absolute, counted from *offset*; line and column
+    numbers count every newline, including those in comments and strings.
+    """
+
+    def __init__(self, offset=0, line_no=1, col_no=1):
+        self.offset = offset
+        self.line_no = line_no
+        self._line_start = offset - (col_no - 1)
+
+    def scan(self, buf, pos=0, end=None, final=True):
+        """Yield tokens from *buf* between *pos* and *end*.
+
+        Unless *final*, a token that might continue past *end* is left
+        unconsumed; scanning stops there and `offset` tells how far it got.
+        Does not emit "eof".
+        """
+        if end is None:
+            end = len(buf)
+        base = self.offset - pos
+        line_no = self.line_no
+        line_start = self._line_start
+        match = _scan_re.match
+        find = buf.find
+
+        while pos < end:
+            m = match(buf, pos, end)
+            lex = m.lastgroup
+            npos = m.end()
+            if lex == "comment_begin":
+                cend = find("*/", npos, end)
+                if cend < 0:
+                    if not final:
+                        break
+                    cend = end
+                offset = base + pos
+                yield Token(lex, "/*", line_no, offset - line_start + 1,
+                            offset)
+                if cend > npos:
+                    value = buf[npos:cend]
+                    offset = base + npos
+                    yield Token("char", value, line_no,
+                                offset - line_start + 1, offset)
+                    nl = value.count("\n")
+                    if nl:
+                        line_no += nl
+                        line_start = offset + value.rfind("\n") + 1
+                if cend < end:
+                    offset = base + cend
+                    yield Token("comment_end", "*/", line_no,
+                                offset - line_start + 1, offset)
+                    cend += 2
+                pos = cend
+                continue
+            elif npos + _scan_lookahead > end and not final:
+                break
+
+            value = m.group()
+            offset = base + pos
+            if lex == "quote" or lex == "data_uri":
+                lex = "char"
+            yield Token(lex, value, line_no, offset - line_start + 1, offset)
+            if lex == "w" or lex == "char":
+                nl = value.count("\n")
+                if nl:
+                    line_no += nl
+                    line_start = offset + value.rfind("\n") + 1
+            pos = npos
+
+        self.offset = base + pos
+        self.line_no = line_no
+        self._line_start = line_start
+
+    def eof(self):
+        return Token("eof", None, self.line_no,
+                     self.offset - self._line_start + 1, self.offset)
+
+    def tokenize_buffer(self, buf, pos=0, end=None):
+        """Yield tokens from all of *buf* (a string or a memory map, which
+        is never copied in full), followed by "eof".
+        """
+        for tok in self.scan(buf, pos=pos, end=end):
+            yield tok
+        yield self.eof()
+
+    def tokenize(self, chunks):
+        """Yield tokens from an iterable of *chunks*, followed by "eof"."""
+        buf = ""
+        for chunk in chunks:
+            if not chunk:
+                continue
+            buf = buf + chunk if buf else chunk
+            start = self.offset
+            for tok in self.scan(buf, final=False):
+                yield tok
+            buf = buf[self.offset - start:]
+        for tok in self.scan(buf):
+            yield tok
+        yield self.eof()
+
+def css_tokenize_scan(it):
+    """Tokenize chunks by scanning runs of characters at once."""
+    return CSSScanner().tokenize(it)
+
+#: Available tokenizer engines, by name.
+tokenizers = {"charwise": css_tokenize_charwise,
+              "scan": css_tokenize_scan}
+default_tokenizer = "scan"
+
+def css_tokenize(it, tokenizer=None):
+    return tokenizers[tokenizer or default_tokenizer](it)
+
+def css_tokenize_data(css, tokenizer=None):
+    return css_tokenize([css], tokenizer=tokenizer)
+
+def map_file(fp):
+    """Map open file *fp* read-only into memory.
+
+    Empty files can't be mapped; an empty string stands in for them.
+    """
+    fp.seek(0, 2)
+    if not fp.tell():
+        return ""
+    return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
 
 class CSSParseState(object):
     """The state of the CSS parser."""
 
-    __slots__ = ("handler", "prev", "counter",
-                 "tokens", "token",
-                 "selector", "declaration", "at_rule",
-                 "comment", "whitespace")
+    __slots__ = ("tokens", "token")
 
-    ## general
     # tokens: iterator over remaining tokens
     # token: current token
-    # handler: current handler of parsed code
-
-    ## interesting buffers
-    # selector: current selector
-    # declaration: current declaration
-    # at_rule: current at rule
 
-    ## uninteresting buffers
-    # comment: comment buffer
-    # whitespace: whitespace buffer
-
-    def __init__(self, tokens, token=None, handler=None, counter=0, prev=None):
+    def __init__(self, tokens, token=None):
         self.token = token
         self.tokens = tokens
-        self.handler = handler
-        self.counter = counter
-        self.prev = prev
-        self.selector = ""
-        self.declaration = ""
-        self.at_rule = ""
-        self.comment = ""
-        self.whitespace = ""
-
-    def __call__(self, data=None, **kwds):
-        if data is not None:
-            self.tokens = css_tokenize_data(data)
-        self.update(**kwds)
-        self.counter += 1
-        return self
-
-    def __iter__(self):
-        return self.iter_tokens()
 
     def __repr__(self):
         pairs = ("%s=%r" % (s, getattr(self, s)) for s in self.__slots__)
@@ -272,82 +387,51 @@ class CSSParseState(object):
     def lexeme(self):
         return self.token.lexeme
 
-    def sub(self, handler=None):
-        return type(self)(self.tokens, token=self.token, handler=handler,
-                          counter=self.counter, prev=self)
-
-    def leave(self):
-        return self.prev(token=self.token)
-
-    def update(self, **kwds):
-        for (nam, val) in kwds.iteritems():
-            if nam not in self.__slots__:
-                raise TypeError(nam)
-            setattr(self, nam, val)
-
-    def next(self):
-        """Take the next token from the token stream and place it as the
-        current `token`.
-
-        If no tokens remain to be had, raises OutOfTokens and sets `token` to
-        None.
-        """
-        try:
-            self.token = tok = self.tokens.next()
-        except StopIteration:
-            self.token = None
-            raise OutOfTokens
-        else:
-            return tok
-
-    def iter_tokens(self, lexemes=None, predicate=None):
-        """Yields current token, if its lexeme in `lexemes`, and churns the
-        token stream until the predicate fails.
-
-        Specify either `lexemes`, a sequence of lexemes to match, or
-        `predicate`, a function to test each token. If neither are given, all
-        tokens are yielded (including the current one.)
-        """
-        if lexemes and predicate:
-            raise TypeError("specify either lexemes or predicate, not both")
-        elif lexemes:
-            predicate = lambda t: t.lexeme in lexemes
-        elif not predicate:
-            predicate = lambda t: True
-
-        tok = self.token
-        while predicate(tok):
-            yield tok
-            tok = self.next()
-
     @classmethod
-    def from_chunks(cls, chunks, **kwds):
+    def from_chunks(cls, chunks, tokenizer=None, **kwds):
         """Set up a CSS parser state from iterable *chunks* which generates
         blocks of code.
+
+        *tokenizer* names the engine to use, see `tokenizers`.
         """
-        return cls(tokens=css_tokenize(chunks), **kwds)
+        return cls(tokens=css_tokenize(chunks, tokenizer=tokenizer), **kwds)
+
+    @classmethod
+    def from_buffer(cls, buf, **kwds):
+        """Set up a CSS parser state scanning *buf* in place."""
+        return cls(tokens=CSSScanner().tokenize_buffer(buf), **kwds)
 
 # {{{ event defs
 class CSSParserEvent(object):
-    __slots__ = ("state",)
+    """An event, spanning source offsets *start* to *end* including any
+    delimiters (so a declaration's span ends after its semicolon.)
+
+    Events that weren't parsed from a source, e.g. ones made up by a filter,
+    have no span.
+    """
 
-    def __init__(self, state):
+    __slots__ = ("state", "start", "end", "line_no")
+
+    def __init__(self, state=None, start=None, end=None, line_no=None):
         self.state = state
+        self.start = start
+        self.end = end
+        self.line_no = line_no
 
 class Selector(CSSParserEvent):
     lexeme = "selector"
     __slots__ = ("selector",)
 
-    def __init__(self, state=None, selector=None):
-        self.state = state
-        self.selector = selector if selector else state.selector
+    def __init__(self, state=None, selector=None, **span):
+        CSSParserEvent.__init__(self, state, **span)
+        self.selector = selector
 
 class AtRule(CSSParserEvent):
     __slots__ = ("at_rule",)
 
-    def __init__(self, state=None, at_rule=None):
-        self.state = state
-        self.at_rule = at_rule if at_rule else state.at_rule
+    def __init__(self, state=None, at_rule=None, **span):
+        CSSParserEvent.__init__(self, state, **span)
+        self.at_rule = at_rule
 
 class AtBlock(AtRule):
     lexeme = "at_block"
@@ -359,58 +443,106 @@ class Comment(CSSParserEvent):
     lexeme = "comment"
     __slots__ = ("comment",)
 
-    def __init__(self, state=None, comment=None):
-        self.state = state
-        self.comment = comment if comment else state.comment
+    def __init__(self, state=None, comment=None, **span):
+        CSSParserEvent.__init__(self, state, **span)
+        self.comment = comment
 
 class Declaration(CSSParserEvent):
+    """A ``prop: value`` declaration. The property name is split off and
+    interned up front, as it's compared over and over; the value is sliced
+    from the declaration when asked for.
+    """
+
     lexeme = "declaration"
-    __slots__ = ("declaration",)
+    __slots__ = ("declaration", "prop", "_colon")
 
-    def __init__(self, state=None, declaration=None):
-        self.state = state
-        self.declaration = declaration if declaration else state.declaration
+    def __init__(self, state=None, declaration=None, **span):
+        CSSParserEvent.__init__(self, state, **span)
+        self.declaration = declaration
+        colon = declaration.find(":")
+        prop = declaration[:colon] if colon >= 0 else declaration
+        self.prop = intern(prop) if type(prop) is str else prop
+        self._colon = colon
+
+    @property
+    def value(self):
+        """Everything after the colon, or None if there is none."""
+        if self._colon >= 0:
+            return self.declaration[self._colon + 1:]
+
+    def split(self):
+        """Same as ``split_declaration(self.declaration)``."""
+        return (self.prop, self.value)
 
 class BlockEnd(CSSParserEvent):
     lexeme = "block_end"
+    __slots__ = ()
 
 class Whitespace(CSSParserEvent):
     lexeme = "whitespace"
     __slots__ = ("whitespace")
 
-    def __init__(self, state=None, whitespace=None):
-        self.state = state
-        self.whitespace = whitespace if whitespace else state.whitespace
+    def __init__(self, state=None, whitespace=None, **span):
+        CSSParserEvent.__init__(self, state, **span)
+        self.whitespace = whitespace
 # }}}
 
 class CSSParser(EventStream):
     """An event stream of parser events."""
 
-    def __init__(self, state=None, data=None):
+    def __init__(self, state=None, data=None, tokenizer=None):
         super(CSSParser, self).__init__()
         if not (state is None) ^ (data is None):
             raise TypeError("specify either state or data, not either or both")
-        elif data:
-            state = CSSParseState.from_chunks([data])
+        elif data is not None:
+            state = CSSParseState.from_chunks([data], tokenizer=tokenizer)
         self.state = state
+        #: the whole source, if known up front
+        self.source = data
+        self._parsing = None
+
+    @classmethod
+    def read_file(cls, fp, chunk_size=8192, tokenizer=None):
+        return cls.from_iter(iter(lambda: fp.read(chunk_size), ""),
+                             tokenizer=tokenizer)
+
+    @classmethod
+    def from_iter(cls, it, tokenizer=None):
+        return cls(CSSParseState.from_chunks(it, tokenizer=tokenizer))
 
     @classmethod
-    def read_file(cls, fp, chunk_size=8192):
-        return cls.from_iter(iter(lambda: fp.read(chunk_size), ""))
+    def from_buffer(cls, buf):
+        self = cls(CSSParseState.from_buffer(buf))
+        self.source = buf
+        return self
 
     @classmethod
-    def from_iter(cls, it):
-        return cls(CSSParseState.from_chunks(it))
+    def from_mmap(cls, fp):
+        """Parse open file *fp* by mapping it into memory.
+
+        Tokens are sliced straight off the mapping, and the parser's `source`
+        is the mapping itself, so events can be resolved against it without
+        the file ever being read into a string.
+        """
+        return cls.from_buffer(map_file(fp))
 
     def __iter__(self):
         return self.iter_events()
 
+    def iter_events(self):
+        while self._events:
+            yield self._events.popleft()
+        if self._parsing is None:
+            self._parsing = self._parse()
+        for ev in self._parsing:
+            yield ev
+
     def _emit_events(self):
-        try:
-            while not self._events:
-                self.state = self.evaluate()
-        except OutOfTokens:
-            return
+        if self._parsing is None:
+            self._parsing = self._parse()
+        for ev in self._parsing:
+            self.push(ev)
+            break
 
     def iter_print_css(self, converter=None):
         """Iterator over printable the CSS code."""
@@ -419,108 +551,128 @@ class CSSParser(EventStream):
             evs = imap(converter, evs)
         return iter_print_css(evs)
 
-    def evaluate(self, st=None):
-        if st is None:
-            st = self.state
-        if st.handler is None:
-            h = self._handle_any
-        else:
-            h = st.handler
-        st.next()
-        new = h(st)
-        if new is None:
-            raise RuntimeError("invalid transition from %r" % (st,))
-        return new
-
-    def _handle_any(self, st):
-        lex = st.lexeme
-        if lex == "comment_begin":
-            return st.sub(self._handle_comment)
-        elif lex == "at":
-            return st(handler=self._handle_at_rule)
-        elif lex == "w":
-            # must not advance token stream
-            st = st.sub(self._handle_whitespace)
-            return st.handler(st)
-        elif lex == "char":
-            return self._handle_selector(st)
-        elif lex == "eof":
-            return st(handler=self._handle_eof)
-
-    def _handle_comment(self, st):
-        for tok in st.iter_tokens(("char",)):
-            st.comment += tok.value
-
-        if st.lexeme == "comment_end":
-            self.push(Comment(st))
-            return st.leave()
-
-    def _handle_selector(self, st):
-        for tok in st.iter_tokens(("char", "w")):
-            st.selector += tok.value
-
-        lex = st.lexeme
-        if lex == "block_begin":
-            self.push(Selector(st))
-            return st(handler=self._handle_declaration)
-        elif lex == "comment_begin":
-            return st.sub(self._handle_whitespace)
-
-    def _handle_declaration(self, st):
-        if not st.declaration:
-            for tok in st.iter_tokens(("w",)):
-                st.whitespace += tok.value
-            if st.whitespace:
-                self.push(Whitespace(st))
-                st = st(whitespace="")
-
-        for tok in st.iter_tokens(("char", "w")):
-            st.declaration += tok.value
-
-        lex = st.lexeme
-        if lex == "semicolon":
-            self.push(Declaration(st))
-            return st(declaration="")
-        elif lex == "comment_begin":
-            return st.sub(self._handle_comment)
-        elif lex == "block_end":
-            # this happens when the last declaration isn't terminated properly
-            # NOTE This is really invalid CSS, but we're nice people.
-            if st.declaration:
-                raise RuntimeError("unconsumed declaration in %r, "
-                                   "missing semicolon?" % (st,))
-                self.push(Declaration(st))
-            self.push(BlockEnd(st))
-            return st(handler=None, declaration="", selector="")
-        elif lex == "w":
-            return st.sub(self._handle_whitespace)
-
-    def _handle_at_rule(self, st):
-        for tok in st.iter_tokens(("char", "w")):
-            st.at_rule += tok.value
-
-        lex = st.lexeme
-        if lex in ("block_begin", "semicolon"):
-            if lex == "block_begin":
-                self.push(AtBlock(st))
-                return st(handler=self._handle_declaration, at_rule="")
-            elif lex == "semicolon":
-                self.push(AtStatement(st))
-                return st(handler=None, at_rule="")
-        elif lex == "comment_begin":
-            return st.sub(self._handle_comment)
-
-    def _handle_whitespace(self, st):
-        for tok in st.iter_tokens(("w",)):
-            st.whitespace += tok.value
-
-        self.push(Whitespace(st))
-        # because the current token is "unconsumed" (i.e. was not whitespace),
-        # we need to ask the default handler what to return
-        return self._handle_any(st.leave())
-
-    def _handle_eof(self, st):
-        raise IOError("cannot parse beyond end of file")
+    def _parse(self):
+        """Run the state machine over the token stream, yielding events.
+
+        Text is collected in lists joined once per event, and the same
+        state object is used throughout, its `token` being kept current.
+        """
+        st = self.state
+        table = _transitions
+        mode = resume = _TOP
+        text = []
+        text_mark = None
+        ws = []
+        ws_mark = None
+        comment = []
+        comment_mark = None
+
+        for tok in st.tokens:
+            st.token = tok
+            lex = tok.lexeme
+            if ws and lex != "w":
+                yield Whitespace(None, "".join(ws), start=ws_mark.offset,
+                                 end=tok.offset, line_no=ws_mark.line_no)
+                ws = []
+
+            try:
+                (action, next_mode) = table[mode][lex]
+            except KeyError:
+                raise RuntimeError("invalid transition from %s on %r"
+                                   % (_mode_names[mode], tok))
+
+            if action == _TEXT or (action == _BLOCK_W and text):
+                if text_mark is None:
+                    text_mark = tok
+                text.append(tok.value)
+            elif action == _WHITESPACE or action == _BLOCK_W:
+                if not ws:
+                    ws_mark = tok
+                ws.append(tok.value)
+            elif action == _COMMENT_TEXT:
+                comment.append(tok.value)
+            elif action == _COMMENT_BEGIN:
+                comment_mark = tok
+                resume = mode
+            elif action == _COMMENT_END:
+                yield Comment(None, "".join(comment), start=comment_mark.offset,
+                              end=tok.offset + 2,
+                              line_no=comment_mark.line_no)
+                comment = []
+                next_mode = resume
+            elif action == _MARK:
+                text_mark = tok
+            elif action == _BLOCK_END:
+                # this happens when the last declaration isn't terminated
+                # properly; really invalid CSS.
+                if text:
+                    raise RuntimeError("unconsumed declaration %r, missing "
+                                       "semicolon?" % ("".join(text),))
+                yield BlockEnd(None, start=tok.offset, end=tok.offset + 1,
+                               line_no=tok.line_no)
+            elif action != _NOP:
+                # the remaining actions end an event of collected text at
+                # the current token
+                if text_mark is None:
+                    text_mark = tok
+                yield _text_events[action](None, "".join(text),
+                                           start=text_mark.offset,
+                                           end=tok.offset + 1,
+                                           line_no=text_mark.line_no)
+                text = []
+                text_mark = None
+
+            mode = next_mode
+
+# {{{ parser state machine
+(_TOP, _SELECTOR, _BLOCK, _AT_RULE, _COMMENT, _EOF) = range(6)
+_mode_names = ("top level", "selector", "block", "at-rule", "comment",
+               "end of file")
+
+# _TEXT collects text for a selector, declaration or at-rule; _BLOCK_W is
+# whitespace in a block, which is text unless a declaration is yet to begin.
+(_NOP, _TEXT, _WHITESPACE, _BLOCK_W, _MARK,
+ _COMMENT_BEGIN, _COMMENT_TEXT, _COMMENT_END, _BLOCK_END,
+ _SELECTOR_END, _DECLARATION_END, _AT_BLOCK_END, _AT_STATEMENT_END) = range(13)
+
+_text_events = {_SELECTOR_END: Selector,
+                _DECLARATION_END: Declaration,
+                _AT_BLOCK_END: AtBlock,
+                _AT_STATEMENT_END: AtStatement}
+
+#: lexeme => (action, next mode) for each mode; a lexeme missing from the
+#: table of a mode is a syntax error. A comment ends in the mode it began in.
+_transitions = (
+    # _TOP
+    {"w": (_WHITESPACE, _TOP),
+     "char": (_TEXT, _SELECTOR),
+     "comment_begin": (_COMMENT_BEGIN, _COMMENT),
+     "at": (_MARK, _AT_RULE),
+     "eof": (_NOP, _EOF)},
+    # _SELECTOR
+    {"char": (_TEXT, _SELECTOR),
+     "w": (_TEXT, _SELECTOR),
+     "comment_begin": (_COMMENT_BEGIN, _COMMENT),
+     "block_begin": (_SELECTOR_END, _BLOCK)},
+    # _BLOCK
+    {"char": (_TEXT, _BLOCK),
+     "w": (_BLOCK_W, _BLOCK),
+     "semicolon": (_DECLARATION_END, _BLOCK),
+     "comment_begin": (_COMMENT_BEGIN, _COMMENT),
+     "block_end": (_BLOCK_END, _TOP)},
+    # _AT_RULE
+    {"char": (_TEXT, _AT_RULE),
+     "w": (_TEXT, _AT_RULE),
+     "comment_begin": (_COMMENT_BEGIN, _COMMENT),
+     "block_begin": (_AT_BLOCK_END, _BLOCK),
+     "semicolon": (_AT_STATEMENT_END, _TOP)},
+    # _COMMENT
+    {"char": (_COMMENT_TEXT, _COMMENT),
+     "comment_end": (_COMMENT_END, None)},
+    # _EOF
+    {},
+)
+# }}}
 
 def iter_print_css(parser):
     for event in parser:
@@ -548,6 +700,49 @@ def print_css(parser, out=sys.stdout):
         #data = cssslash.sub('/',data)
         out.write(data)
 
+def iter_spliced_css(events, source, copy=True):
+    """Iterator over the CSS code of *events*, copied verbatim from *source*
+    wherever possible.
+
+    Events that have a source span are taken to be unmodified, and contiguous
+    runs of them are yielded as single slices of *source* (or, unless *copy*,
+    buffer objects referring to it.) Events without a span (those made up or
+    rewritten by a filter) are printed, and source ranges of events that were
+    left out are skipped.
+    """
+    if copy:
+        view = lambda start, end: source[start:end]
+    else:
+        view = lambda start, end: buffer(source, start, end - start)
+    # [start, end) is the pending range; flushed is where the last one ended
+    start = end = flushed = 0
+    for ev in events:
+        if ev.start is None:
+            if start < end:
+                yield view(start, end)
+            flushed = start = end
+            for data in iter_print_css((ev,)):
+                yield data
+        elif ev.start >= end:
+            if ev.start > end:
+                if start < end:
+                    yield view(start, end)
+                    flushed = end
+                start = ev.start
+            end = ev.end
+        else:
+            # overlaps the pending range, e.g. a declaration with a comment
+            # inside, which comes after the comment
+            start = min(start, max(ev.start, flushed))
+            end = max(end, ev.end)
+    if start < end:
+        yield view(start, end)
+
+def splice_css(events, source, out=sys.stdout):
+    """Write *events* to *out*, copying unmodified ranges from *source*."""
+    for data in iter_spliced_css(events, source, copy=False):
+        out.write(data)
+
 def main():
     print_css(CSSParser.read_file(sys.stdin), out=sys.stdout)
 
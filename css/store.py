@@ -0,0 +1,233 @@
+"""Compact, offset-based storage of CSS parser events
+
+An `EventStore` keeps one source buffer and, for each event, a lexeme code,
+the start and end offsets of the event in the source and its line number,
+in parallel arrays. Event text is sliced from the source when an event is
+accessed, so a parsed stylesheet costs a few bytes per event on top of the
+source itself.
+
+The store is itself an iterable of events, and can be used wherever a
+`CSSParser` can::
+
+    store = EventStore.read_file(fp)
+    conf = CSSConfig(store, fname=fname)
+    srefs = find_sprite_refs(store, conf=conf, source=fname)
+"""
+
+from array import array
+from itertools import imap, izip
+
+from .parser import (CSSParser, CSSParseState, CSSScanner, Comment, Selector,
+                     Declaration, BlockEnd, Whitespace, AtBlock, AtStatement)
+
+#: event types, indexed by lexeme code
+event_types = (Comment, Selector, Declaration, BlockEnd,
+               Whitespace, AtBlock, AtStatement)
+
+lexeme_codes = dict((cls.lexeme, code)
+                    for (code, cls) in enumerate(event_types))
+
+#: text attribute and lengths of the delimiters around the text of an event
+_text_spans = {"comment": ("comment", 2, 2),
+               "selector": ("selector", 0, 1),
+               "declaration": ("declaration", 0, 1),
+               "block_end": (None, 1, 0),
+               "whitespace": ("whitespace", 0, 0),
+               "at_block": ("at_rule", 1, 1),
+               "at_statement": ("at_rule", 1, 1)}
+
+_code_spans = tuple(_text_spans[cls.lexeme] for cls in event_types)
+
+_opens_block = (lexeme_codes["selector"], lexeme_codes["at_block"])
+_block_end = lexeme_codes["block_end"]
+_at_statement = lexeme_codes["at_statement"]
+_whitespace = lexeme_codes["whitespace"]
+
+class EventStore(object):
+    """Parallel arrays of (lexeme code, start, end, line number) pointing
+    into *source*.
+
+    Texts that aren't a contiguous slice of the source (say, a declaration
+    with a comment in it) are kept as is in a side table.
+    """
+
+    def __init__(self, source, codes=None, starts=None, ends=None,
+                 lines=None, texts=None):
+        self.source = source
+        self.codes = codes if codes is not None else array("B")
+        self.starts = starts if starts is not None else array("I")
+        self.ends = ends if ends is not None else array("I")
+        self.lines = lines if lines is not None else array("I")
+        self.texts = texts if texts is not None else {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        return imap(self.__getitem__, xrange(len(self.codes)))
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self.codes)
+        code = self.codes[idx]
+        cls = event_types[code]
+        span = dict(start=self.starts[idx], end=self.ends[idx],
+                    line_no=self.lines[idx])
+        if cls is BlockEnd:
+            return cls(None, **span)
+        return cls(None, self.text(idx), **span)
+
+    def __repr__(self):
+        return "<%s (%d events)>" % (type(self).__name__, len(self))
+
+    def iter_events(self):
+        return iter(self)
+
+    @property
+    def columns(self):
+        """The arrays of the store, without its source. These are compact
+        and picklable, and ``EventStore(source, *columns)`` restores them.
+        """
+        return (self.codes, self.starts, self.ends, self.lines, self.texts)
+
+    def lexeme(self, idx):
+        return event_types[self.codes[idx]].lexeme
+
+    def text(self, idx):
+        """Materialize the text of event *idx*."""
+        if idx in self.texts:
+            return self.texts[idx]
+        (attr, pre, post) = _code_spans[self.codes[idx]]
+        if attr is None:
+            return None
+        return self.source[self.starts[idx] + pre:self.ends[idx] - post]
+
+    def append(self, ev):
+        code = lexeme_codes[ev.lexeme]
+        if ev.start is None:
+            raise ValueError("event %r has no source span" % (ev,))
+        (attr, pre, post) = _code_spans[code]
+        if attr is not None:
+            text = getattr(ev, attr)
+            if len(text) != ev.end - ev.start - pre - post:
+                self.texts[len(self.codes)] = text
+        self.codes.append(code)
+        self.starts.append(ev.start)
+        self.ends.append(ev.end)
+        self.lines.append(ev.line_no)
+
+    def extend(self, evs):
+        for ev in evs:
+            self.append(ev)
+
+    def iter_spans(self):
+        """Iterate over (lexeme, start, end) without materializing events."""
+        lexemes = [cls.lexeme for cls in event_types]
+        return izip(imap(lexemes.__getitem__, self.codes),
+                    self.starts, self.ends)
+
+    def iter_restart_points(self):
+        """Yield (offset, index) of each point where parsing can begin
+        afresh: the start of the source, and the end of each block,
+        at-statement and whitespace outside of blocks. *index* is that of
+        the event beginning there.
+        """
+        yield (0, 0)
+        in_block = False
+        for (idx, code) in enumerate(self.codes):
+            if code in _opens_block:
+                in_block = True
+            elif code == _block_end:
+                in_block = False
+                yield (self.ends[idx], idx + 1)
+            elif code == _at_statement or (code == _whitespace
+                                           and not in_block):
+                yield (self.ends[idx], idx + 1)
+
+    def reparse(self, source, start, end, new_end):
+        """Return a store of the events of *source*, which is the source of
+        this store with the range *start* to *end* replaced by what is now
+        at *start* to *new_end*.
+
+        Only the top-level blocks touched by the change are parsed again:
+        from the last restart point before the change until the new events
+        fall back in step with the old ones. The events before are kept,
+        and those after are moved by the difference in length and lines.
+        """
+        (pos, idx) = (0, 0)
+        resume = {}
+        for (offset, i) in self.iter_restart_points():
+            if offset < start:
+                (pos, idx) = (offset, i)
+            elif offset >= end:
+                resume[offset] = i
+        delta = new_end - end
+        line_delta = (source[start:new_end].count("\n") -
+                      self.source[start:end].count("\n"))
+
+        new = type(self)(source, self.codes[:idx], self.starts[:idx],
+                         self.ends[:idx], self.lines[:idx])
+        new.texts.update((k, v) for (k, v) in self.texts.iteritems()
+                         if k < idx)
+
+        # the event before the restart point ends there, and nothing before
+        # the change has moved
+        if idx:
+            prev = self.starts[idx - 1]
+            line_no = self.lines[idx - 1] + source[prev:pos].count("\n")
+        else:
+            line_no = 1
+        col_no = pos - source.rfind("\n", 0, pos)
+
+        toks = CSSScanner(pos, line_no, col_no).tokenize_buffer(source, pos)
+        in_block = False
+        for ev in CSSParser(CSSParseState(toks)):
+            new.append(ev)
+            code = new.codes[-1]
+            if code in _opens_block:
+                in_block = True
+                continue
+            elif code == _block_end:
+                in_block = False
+            elif not (code == _at_statement or (code == _whitespace
+                                                and not in_block)):
+                continue
+            if ev.end >= new_end and ev.end - delta in resume:
+                old_idx = resume[ev.end - delta]
+                break
+        else:
+            return new
+
+        base = len(new) - old_idx
+        new.codes.extend(self.codes[old_idx:])
+        new.starts.extend(array("I", [v + delta
+                                      for v in self.starts[old_idx:]]))
+        new.ends.extend(array("I", [v + delta for v in self.ends[old_idx:]]))
+        new.lines.extend(array("I", [v + line_delta
+                                     for v in self.lines[old_idx:]]))
+        new.texts.update((k + base, v) for (k, v) in self.texts.iteritems()
+                         if k >= old_idx)
+        return new
+
+    @classmethod
+    def from_events(cls, events, source):
+        """Store *events* parsed from *source*."""
+        self = cls(source)
+        self.extend(events)
+        return self
+
+    @classmethod
+    def from_data(cls, data, tokenizer=None):
+        return cls.from_events(CSSParser(data=data, tokenizer=tokenizer), data)
+
+    @classmethod
+    def read_file(cls, fp, tokenizer=None):
+        return cls.from_data(fp.read(), tokenizer=tokenizer)
+
+    @classmethod
+    def from_mmap(cls, fp):
+        """Store the events of open file *fp*, keeping the file mapped into
+        memory as the source rather than reading it.
+        """
+        parser = CSSParser.from_mmap(fp)
+        return cls.from_events(parser, parser.source)
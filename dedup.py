@@ -0,0 +1,46 @@
+"""Finding sprites that are the same image under different paths
+
+Each spritemap is cut down to one sprite per distinct image, and the others
+are kept as aliases of that one, so the replacer can point them all at the
+same place in the spritemap.
+"""
+
+import hashlib
+
+from . import SpriteMap
+from .image import default_reader, decode_file
+
+def contents_digest(fname, reader=default_reader, cache=None):
+    """Digest of the contents of the file at *fname*."""
+    data = reader.read(fname)
+    return (len(data), hashlib.sha1(data).digest())
+
+def pixels_digest(fname, reader=default_reader, cache=None):
+    """Digest of the decoded pixels of the image at *fname*, so that the
+    same image saved in other ways counts as the same.
+    """
+    (width, height, rows, meta) = decode_file(fname, reader.read(fname),
+                                              cache)
+    h = hashlib.sha1("%dx%d@%d\0" % (width, height, meta["bitdepth"]))
+    for row in rows:
+        h.update(row.tostring())
+    return h.digest()
+
+digests = {"contents": contents_digest, "pixels": pixels_digest}
+
+def dedup_spritemap(smap, mode="contents", cache=None):
+    """Return (a `SpriteMap` of the first sprite of *smap* for each image,
+    a dict of every other sprite to the first one of the same image.)
+    *mode* tells what to compare: see `digests`.
+    """
+    digest = digests[mode]
+    firsts = {}
+    unique = SpriteMap(smap.fname)
+    aliases = {}
+    for sref in smap:
+        first = firsts.setdefault(digest(str(sref), cache=cache), sref)
+        if first is sref:
+            unique.add(sref)
+        else:
+            aliases[sref] = first
+    return (unique, aliases)
@@ -5,16 +5,25 @@ import logging
 from os import path
 
 from . import SpriteRef
-from .config import CSSConfig
+from .config import CSSConfig, iter_config_stmts
 from .css import split_declaration
+from .css.store import EventStore
+from .css.parallel import (segment_size, split_segments, iter_segment_texts,
+                           parse_segment, merge_columns)
 
 logger = logging.getLogger(__name__)
 
 bg_url_re = re.compile(r'\s*url\([\'"]?(.*?)[\'"]?\)\s*')
+data_url_re = re.compile(r'url\(\s*[\'"]?data:')
+# anything that might be a sprite reference: a background with an url, bar
+# inline data: URIs
+candidate_re = re.compile(r'background(?:-image)?\s*:[^{}]*?'
+                          r'url\((?!\s*[\'"]?data:)')
 po_url_re = re.compile(r'(^-?\d+(%|in|cm|mm|em|ex|pt|pc|px)?)')
 
 class NoSpriteFound(Exception): pass
 class PositionedBackground(NoSpriteFound): pass
+class InlineData(NoSpriteFound): pass
 
 _pos_names = {"top":"0%",
               "center":"50%",
@@ -52,6 +61,8 @@ def _replace_sref_val(position):
     return returnList
 
 def _match_background_url(val):
+    if data_url_re.search(val):
+        raise InlineData(val)
     mo = bg_url_re.search(val)
     if not mo:
         return ""
@@ -70,18 +81,30 @@ def get_background_position(val):
 def get_Position(val , sure_bg_position = False):
         return _bg_positioned(val , sure_bg_position)
 
+background_props = ("background", "background-image")
+
 def find_decl_background_url(decl):
     (prop, val) = split_declaration(decl)
-    if prop not in ("background", "background-image"):
+    if prop not in background_props:
         raise NoSpriteFound(decl)
     return get_background_url(val)
 
+def find_background_url(ev):
+    """Like `find_decl_background_url`, for a declaration event."""
+    if ev.prop not in background_props:
+        raise NoSpriteFound(ev.declaration)
+    return get_background_url(ev.value)
+
 class SpriteEvent(object):
     lexeme = "spriteref"
 
     def __init__(self, ev, sprite):
         self.state = ev.state
+        self.start = ev.start
+        self.end = ev.end
+        self.line_no = ev.line_no
         self.declaration = ev.declaration
+        self.prop = ev.prop
         self.sprite = sprite
 
 def iter_spriterefed(evs, conf=None, source=None, root=None):
@@ -99,7 +122,7 @@ def iter_spriterefed(evs, conf=None, source=None, root=None):
     for ev in evs:
         if ev.lexeme == "declaration":
             try:
-                url = find_decl_background_url(ev.declaration)
+                url = find_background_url(ev)
             except NoSpriteFound:
                 pass
             else:
@@ -112,6 +135,88 @@ def find_sprite_refs(*args, **kwds):
         if ev.lexeme == "spriteref":
             yield ev.sprite
 
+def has_sprite_candidates(data):
+    """Scan raw stylesheet *data* for anything that could be a sprite
+    reference.
+
+    Errs on the side of yes; a stylesheet this says no to can be copied to
+    its output without being parsed.
+    """
+    return candidate_re.search(data) is not None
+
+class ScannedCSS(object):
+    """Everything a build needs from a stylesheet, gathered in one pass.
+
+    *conf* is the stylesheet's configuration, *srefs* its sprite references
+    and *events* whatever the events were collected into (pass an
+    `EventStore` to be able to replay them.) *stmts* are the config
+    statements found in the stylesheet itself, in order, and *urls* the
+    URLs of *srefs* as written.
+    """
+
+    def __init__(self, conf, srefs, events=None, stmts=(), urls=()):
+        self.conf = conf
+        self.srefs = srefs
+        self.events = events
+        self.stmts = stmts
+        self.urls = urls
+
+def scan_css(evs, source, base=None, store=None):
+    """Traverse *evs* once, collecting config statements and sprite refs,
+    and appending each event to *store* if given.
+
+    Sprite reference paths only depend on where *source* is, so config
+    statements found after a reference don't change how it is resolved.
+    """
+    conf = CSSConfig(base=base, fname=source)
+    normpath = conf.normpath
+    srefs = []
+    urls = []
+    stmts = []
+    for ev in evs:
+        if store is not None:
+            store.append(ev)
+        lex = ev.lexeme
+        if lex == "declaration":
+            try:
+                url = find_background_url(ev)
+            except NoSpriteFound:
+                continue
+            srefs.append(SpriteRef(normpath(url), source=source))
+            urls.append(url)
+        elif lex == "comment":
+            stmts.extend(iter_config_stmts(ev.comment))
+    conf.update(stmts)
+    return ScannedCSS(conf, srefs, events=store, stmts=stmts, urls=urls)
+
+def _scan_segment_job(args):
+    (source, segment) = args
+    scanned = scan_css(parse_segment(*segment), source, store=EventStore(None))
+    return (scanned.stmts, scanned.urls, scanned.events.columns)
+
+def scan_css_parallel(data, source, pool, base=None, size=segment_size):
+    """Like `scan_css`, but splits stylesheet *data* into segments of about
+    *size* bytes and scans them on the worker *pool*.
+
+    The results are merged in order, so they are the same as those of a
+    single pass.
+    """
+    conf = CSSConfig(base=base, fname=source)
+    srefs = []
+    urls = []
+    stmts = []
+    store = EventStore(data)
+    segments = iter_segment_texts(data, split_segments(data, size))
+    jobs = ((source, segment) for segment in segments)
+    for (seg_stmts, seg_urls, columns) in pool.imap(_scan_segment_job, jobs):
+        stmts.extend(seg_stmts)
+        srefs.extend(SpriteRef(conf.normpath(url), source=source)
+                     for url in seg_urls)
+        urls.extend(seg_urls)
+        merge_columns(store, columns)
+    conf.update(stmts)
+    return ScannedCSS(conf, srefs, events=store, stmts=stmts, urls=urls)
+
 def main():
     import sys
     import json
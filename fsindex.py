@@ -0,0 +1,89 @@
+"""In-memory index of which sprite files exist
+
+Looking up every sprite reference with `os.access` costs a system call per
+reference, which adds up on network file systems. A `FileIndex` lists each
+directory once and answers from that listing; only files that are there get
+checked for readability, and only once each.
+"""
+
+import os
+import logging
+from os import path, R_OK
+
+logger = logging.getLogger(__name__)
+
+class _Listing(object):
+    __slots__ = ("mtime", "names", "readable")
+
+    def __init__(self, mtime, names):
+        self.mtime = mtime
+        self.names = names
+        self.readable = {}
+
+class FileIndex(object):
+    """Existence and readability of files, by directory listing.
+
+    Listings are kept for the life of the index. If *validate*, each lookup
+    stats the directory first and lists it again if it has changed since,
+    which suits processes that outlive a build.
+    """
+
+    def __init__(self, validate=False):
+        self.validate = validate
+        self._dirs = {}
+
+    def _list(self, dirname):
+        try:
+            mtime = os.stat(dirname or os.curdir).st_mtime
+            names = frozenset(os.listdir(dirname or os.curdir))
+        except OSError, e:
+            logger.debug("cannot list %s: %s", dirname, e)
+            return _Listing(None, frozenset())
+        return _Listing(mtime, names)
+
+    def listing(self, dirname):
+        listing = self._dirs.get(dirname)
+        if listing is None:
+            listing = self._dirs[dirname] = self._list(dirname)
+        elif self.validate:
+            try:
+                mtime = os.stat(dirname or os.curdir).st_mtime
+            except OSError:
+                mtime = None
+            if mtime != listing.mtime:
+                listing = self._dirs[dirname] = self._list(dirname)
+        return listing
+
+    def _answers(self, listing, name):
+        """Whether *listing* can tell if *name* is there: directories that
+        couldn't be listed can't, and neither ``.`` nor ``..`` are listed.
+        """
+        return (listing.mtime is not None
+                and name not in ("", os.curdir, os.pardir))
+
+    def exists(self, fname):
+        (dirname, name) = path.split(fname)
+        listing = self.listing(dirname)
+        if not self._answers(listing, name):
+            return path.exists(fname)
+        return name in listing.names
+
+    def readable(self, fname):
+        """Like ``os.access(fname, R_OK)``, but asks the file system once
+        per file at most, and not at all for files that aren't listed.
+        """
+        (dirname, name) = path.split(fname)
+        listing = self.listing(dirname)
+        if name not in listing.names and self._answers(listing, name):
+            return False
+        rv = listing.readable.get(name)
+        if rv is None:
+            rv = listing.readable[name] = os.access(fname, R_OK)
+        return rv
+
+    def invalidate(self, dirname=None):
+        """Forget the listing of *dirname*, or of all directories."""
+        if dirname is None:
+            self._dirs.clear()
+        else:
+            self._dirs.pop(dirname, None)
@@ -1,5 +1,169 @@
+import os
+import struct
+import tempfile
+import threading
+from array import array
+from cStringIO import StringIO
+
 from . import png
 
+# signature, then the length, type and contents of the IHDR chunk, which
+# always comes first
+_png_header = struct.Struct("!8sI4s2I5B")
+
+def read_header(fo):
+    """Read (width, height, bitdepth, color type) of the PNG image *fo*
+    from its first few bytes.
+    """
+    return parse_header(fo.read(_png_header.size))
+
+def parse_header(data):
+    """Like `read_header`, from the first bytes of a PNG image *data*."""
+    data = data[:_png_header.size]
+    if len(data) != _png_header.size:
+        raise png.FormatError("PNG file is too short for a header.")
+    (sig, length, ctype, width, height, bitdepth, color_type,
+     compression, filter, interlace) = _png_header.unpack(data)
+    if sig != png._signature:
+        raise png.FormatError("PNG file has invalid signature.")
+    if ctype != "IHDR" or length != 13:
+        raise png.FormatError("PNG file does not start with an IHDR chunk.")
+    return (width, height, bitdepth, color_type)
+
+class FileReader(object):
+    """Reads files whole, or their first bytes, keeping no more than
+    *max_open* of them open at any one time.
+    """
+
+    def __init__(self, max_open=16):
+        self.max_open = max_open
+        self._slots = threading.BoundedSemaphore(max_open)
+
+    def read(self, fname, size=-1):
+        with self._slots:
+            with open(fname, "rb") as fo:
+                return fo.read(size)
+
+default_reader = FileReader()
+
+def decode_rgba(data):
+    """Decode PNG image *data* into (width, height, rows, meta), the rows
+    being arrays of RGBA values as per `png.Reader.asRGBA`.
+    """
+    r = png.Reader(file=StringIO(data))
+    (width, height, pixels, meta) = r.asRGBA()
+    tc = "BH"[meta["bitdepth"] > 8]
+    rows = [row if isinstance(row, array) else array(tc, row)
+            for row in pixels]
+    return (width, height, rows, meta)
+
+def decode_file(fname, data, cache=None):
+    """Decode PNG image *data*, read from *fname*, like `decode_rgba`;
+    given a `spritecss.cache.SpriteCache`, look it up there first and
+    store it there otherwise.
+    """
+    if cache is not None:
+        rv = cache.load(fname, data)
+        if rv is not None:
+            return rv
+    rv = decode_rgba(data)
+    if cache is not None:
+        cache.save(fname, data, rv)
+    return rv
+
+class RawPixels(object):
+    """Rows of *width* RGBA pixels, one after the other in *buf* from
+    *offset* on, read out as arrays of *typecode* as they're iterated over.
+    """
+
+    def __init__(self, buf, width, height, typecode="B", planes=4,
+                 offset=0):
+        self.buf = buf
+        self.width = width
+        self.height = height
+        self.typecode = typecode
+        self.planes = planes
+        self.offset = offset
+
+    def __len__(self):
+        return self.height
+
+    @property
+    def row_size(self):
+        return self.width * self.planes * array(self.typecode).itemsize
+
+    def __iter__(self):
+        step = self.row_size
+        pos = self.offset
+        for y in xrange(self.height):
+            row = array(self.typecode)
+            row.fromstring(self.buf[pos:pos + step])
+            pos += step
+            yield row
+
+#: where decoded images are handed over from worker processes
+shm_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+def _decode_job(args):
+    (fname, data, dirname, cache) = args
+    (width, height, rows, meta) = decode_file(fname, data, cache)
+    (fd, raw_fname) = tempfile.mkstemp(dir=dirname, prefix="spritecss-")
+    with os.fdopen(fd, "wb") as fp:
+        for row in rows:
+            row.tofile(fp)
+    return (raw_fname, meta)
+
+def _unlink_results(results):
+    """Unlink the files of whatever *results* of `_decode_job` are left."""
+    while True:
+        try:
+            (raw_fname, meta) = results.next()
+        except StopIteration:
+            break
+        except Exception:
+            continue
+        try:
+            os.unlink(raw_fname)
+        except OSError:
+            pass
+
+def decode_images(images, pool, dirname=None):
+    """Decode the pixels of the `LazyImage` objects among *images* that
+    aren't yet, on the worker *pool*.
+
+    Workers write the pixels to files in *dirname* (by default `shm_dir`),
+    which are read back here and unlinked, rather than sending them back
+    pickled. Images found in their cache aren't sent at all.
+    """
+    if dirname is None:
+        dirname = shm_dir
+    todo = []
+    jobs = []
+    for im in images:
+        if not isinstance(im, LazyImage) or im.decoded:
+            continue
+        data = im.reader.read(im.fname)
+        if im.cache is not None:
+            rv = im.cache.load(im.fname, data)
+            if rv is not None:
+                im._decoded = (rv[2], rv[3])
+                continue
+        todo.append(im)
+        jobs.append((im.fname, data, dirname, im.cache))
+    results = pool.imap(_decode_job, jobs)
+    try:
+        for im in todo:
+            (raw_fname, meta) = results.next()
+            try:
+                with open(raw_fname, "rb") as fp:
+                    buf = fp.read()
+            finally:
+                os.unlink(raw_fname)
+            tc = "BH"[meta["bitdepth"] > 8]
+            im._decoded = (RawPixels(buf, im.width, im.height, tc), meta)
+    finally:
+        _unlink_results(results)
+
 # TODO Image class should abstract `pixels`
 # TODO Image class shouldn't assume RGBA
 class Image(object):
@@ -10,9 +174,16 @@ class Image(object):
         self._meta = meta
 
     @classmethod
-    def load(cls, fo):
-        r = png.Reader(fo)
-        self = cls(*r.asRGBA())
+    def load(cls, fo, cache=None):
+        """Decode PNG file *fo*, through *cache* (see `decode_file`) if
+        given and *fo* has a name.
+        """
+        fname = getattr(fo, "name", None)
+        if cache is not None and fname is not None:
+            self = cls(*decode_file(fname, fo.read(), cache))
+        else:
+            r = png.Reader(fo)
+            self = cls(*r.asRGBA())
         self.close = fo.close
         return self
 
@@ -30,3 +201,54 @@ class Image(object):
     @property
     def bitdepth(self):
         return self._meta["bitdepth"]
+
+class LazyImage(Image):
+    """An image whose size is known up front, from the PNG header of
+    *fname*, and whose pixels are decoded the first time they're needed.
+
+    Files are read whole and closed again through *reader*, a `FileReader`,
+    and decoded into rows owned by the image, so no file stays open. Given
+    a *cache*, decoding goes through it as per `decode_file`.
+
+    The bit depth is that of the decoded pixels (see `png.Reader.asRGBA`),
+    which the header alone can't tell, so it is decoded for too.
+    """
+
+    def __init__(self, fname, width, height, reader=default_reader,
+                 cache=None):
+        self.fname = fname
+        self.width = width
+        self.height = height
+        self.reader = reader
+        self.cache = cache
+        self._decoded = None
+
+    @classmethod
+    def probe(cls, fname, reader=default_reader, cache=None):
+        data = reader.read(fname, _png_header.size)
+        (width, height, bitdepth, color_type) = parse_header(data)
+        return cls(fname, width, height, reader=reader, cache=cache)
+
+    def decode(self):
+        if self._decoded is None:
+            data = self.reader.read(self.fname)
+            (width, height, rows, meta) = decode_file(self.fname, data,
+                                                      self.cache)
+            self._decoded = (rows, meta)
+        return self._decoded
+
+    @property
+    def pixels(self):
+        return self.decode()[0]
+
+    @property
+    def _meta(self):
+        return self.decode()[1]
+
+    @property
+    def decoded(self):
+        return self._decoded is not None
+
+    def close(self):
+        """Drop the decoded pixels."""
+        self._decoded = None
@@ -0,0 +1,62 @@
+"""Finding the stylesheets a stylesheet imports
+
+Like configuration comments, ``@import`` statements are scanned for in the
+raw stylesheet rather than parsed out of it, so that stylesheets with
+nothing to do with sprites needn't be parsed to follow their imports.
+"""
+
+import re
+import logging
+from os import path
+
+from .css.parser import string_pattern, comment_pattern
+
+logger = logging.getLogger(__name__)
+
+_import_re = re.compile(r"""
+    %s
+  | %s
+  | @import\s*(?:url\(\s*(?:"([^"]*)"|'([^']*)'|([^)\s]*))\s*\)
+                |"([^"]*)"|'([^']*)')
+""" % (string_pattern, comment_pattern), re.X | re.S)
+
+_scheme_re = re.compile(r"^(?:[a-zA-Z][a-zA-Z0-9+.-]*:|//)")
+
+def iter_import_urls(data):
+    """Yield the URL of every ``@import`` in raw stylesheet *data*."""
+    if data.find("@import") < 0:
+        return
+    for mo in _import_re.finditer(data):
+        for url in mo.groups():
+            if url is not None:
+                yield url
+                break
+
+def iter_imports(data, conf, source=None):
+    """Yield the filenames of the local stylesheets imported by *data*,
+    the stylesheet *source*, resolved relative to the root of *conf*.
+    """
+    for url in iter_import_urls(data):
+        url = url.split("?", 1)[0].split("#", 1)[0]
+        if not url or _scheme_re.match(url):
+            logger.debug("%s: not following import of %s", source, url)
+            continue
+        fname = conf.normpath(url)
+        if not path.isfile(fname):
+            logger.warning("%s: imported stylesheet %s not found",
+                           source, fname)
+            continue
+        yield fname
+
+def main():
+    import sys
+    for fname in sys.argv[1:]:
+        with open(fname, "rb") as fp:
+            data = fp.read()
+        print "%s\n%s\n" % (fname, "=" * len(fname))
+        for url in iter_import_urls(data):
+            print url
+        print
+
+if __name__ == "__main__":
+    main()
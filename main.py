@@ -1,102 +1,345 @@
 # coding=utf-8
+import os
 import sys
+import shutil
 import logging
 import optparse
-from os import path, access, R_OK
+from os import path
 from itertools import ifilter
 from contextlib import contextmanager
+from multiprocessing import Pool
 
-from spritecss.css import CSSParser, print_css
+from spritecss.css import CSSParser, EventStore, print_css, splice_css
+from spritecss import SpriteRef
+from spritecss.css.parser import map_file
 from spritecss.config import CSSConfig
-from spritecss.finder import find_sprite_refs
+from spritecss.finder import (scan_css, scan_css_parallel,
+                              has_sprite_candidates)
+from spritecss.css.parallel import segment_size
 from spritecss.mapper import SpriteMapCollector, mapper_from_conf
 from spritecss.packing import PackedBoxes, print_packed_size
 from spritecss.packing.sprites import open_sprites
 from spritecss.stitch import stitch
 from spritecss.replacer import SpriteReplacer
+from spritecss.cache import ParseCache, SpriteCache
+from spritecss.imports import iter_imports
+from spritecss.fsindex import FileIndex
+from spritecss.dedup import dedup_spritemap
 
 logger = logging.getLogger(__name__)
 
 # TODO CSSFile should probably fit into the bigger picture
 class CSSFile(object):
-    def __init__(self, fname, conf=None):
+    """A stylesheet, parsed once: its configuration, sprite references and
+    an `EventStore` to replay its events from when writing output.
+
+    A *passthrough* stylesheet has nothing to do with sprites, and is
+    copied to its output as is. *imports* are the filenames of the local
+    stylesheets it imports, if these were looked for.
+    """
+
+    def __init__(self, fname, conf=None, srefs=None, events=None,
+                 passthrough=False, imports=()):
         self.fname = fname
         self.conf = conf
+        self.srefs = srefs
+        self.passthrough = passthrough
+        self.imports = imports
+        self._evs = events
+        self._mapper = None
 
     @contextmanager
     #open_parser:打开文件 返回一个迭代器 迭代内容是CSSParser实例.
     def open_parser(self):
+        if self._evs is not None:
+            with self.open_source():
+                yield self._evs
+        else:
+            with open(self.fname, "rb") as fp:
+                yield CSSParser.read_file(fp)
+
+    @contextmanager
+    def open_source(self):
+        """Make `source` available for the duration. A stylesheet opened
+        with *mmap* is mapped into memory again only as long as this lasts,
+        so that it holds no file descriptor in between.
+        """
+        if self._evs is None or self._evs.source is not None:
+            yield self.source
+            return
         with open(self.fname, "rb") as fp:
-            yield CSSParser.read_file(fp)
+            buf = map_file(fp)
+        self._evs.source = buf
+        try:
+            yield buf
+        finally:
+            self._evs.source = None
+            if buf:
+                buf.close()
+
+    @classmethod
+    def open_file(cls, fname, conf=None, mmap=False, pool=None, cache=None,
+                  follow_imports=False):
+        """Parse *fname*; if *mmap*, the file is mapped into memory rather
+        than read, and mapped again when its events are replayed (see
+        `open_source`.)
+
+        Given a worker *pool*, a large file is split up and its parts parsed
+        in parallel. Given a `ParseCache`, results are loaded from it when
+        possible, and saved to it otherwise. The stylesheets it imports are
+        only looked for if *follow_imports*.
+        """
+        kwds = dict(conf=conf, pool=pool, cache=cache,
+                    follow_imports=follow_imports)
+        with open(fname, "rb") as fp:
+            if not mmap:
+                data = fp.read()
+                return cls._open_data(fname, data, CSSParser(data=data),
+                                      **kwds)
+            data = map_file(fp)
+        try:
+            self = cls._open_data(fname, data, CSSParser.from_buffer(data),
+                                  **kwds)
+        finally:
+            if data:
+                data.close()
+        if self._evs is not None:
+            self._evs.source = None
+        return self
+
+    @classmethod
+    def _open_data(cls, fname, data, parser, conf=None, pool=None,
+                   cache=None, follow_imports=False):
+        if not has_sprite_candidates(data):
+            logger.debug("%s: no sprite candidates, passing through", fname)
+            conf = CSSConfig.from_data(data, base=conf, fname=fname)
+            imports = []
+            if follow_imports:
+                imports = list(iter_imports(data, conf, fname))
+            return cls(fname, conf=conf, srefs=[], passthrough=True,
+                       imports=imports)
+        scanned = None
+        if cache is not None:
+            scanned = cache.load(data, fname, base=conf)
+            if scanned is not None:
+                logger.debug("%s: loaded from parse cache", fname)
+        if scanned is None:
+            if pool is not None and len(data) >= 2 * segment_size:
+                scanned = scan_css_parallel(data, fname, pool, base=conf)
+            else:
+                scanned = scan_css(parser, fname, base=conf,
+                                   store=EventStore(data))
+            if cache is not None:
+                cache.save(data, fname, scanned)
+        imports = []
+        if follow_imports:
+            imports = list(iter_imports(data, scanned.conf, fname))
+        return cls(fname, conf=scanned.conf, srefs=scanned.srefs,
+                   events=scanned.events, imports=imports)
+
+    def to_result(self):
+        """Reduce to a compact, picklable tuple, leaving out the source;
+        see `from_result`.
+        """
+        evs = self._evs.columns if self._evs is not None else None
+        srefs = [sref.fname for sref in self.srefs]
+        return (self.fname, self.conf, srefs, evs, self.passthrough,
+                self.imports)
 
     @classmethod
-    def open_file(cls, fname, conf=None):
-        with cls(fname).open_parser() as p:
-            return cls(fname, conf=CSSConfig(p, base=conf, fname=fname))
+    def from_result(cls, result, mmap=False):
+        """Restore a CSSFile from `to_result`, reading its source again,
+        or if *mmap*, leaving it to `open_source` to map.
+        """
+        (fname, conf, srefs, evs, passthrough, imports) = result
+        srefs = [SpriteRef(sref, source=fname) for sref in srefs]
+        if evs is not None and mmap:
+            evs = EventStore(None, *evs)
+        elif evs is not None:
+            with open(fname, "rb") as fp:
+                evs = EventStore(fp.read(), *evs)
+        return cls(fname, conf=conf, srefs=srefs, events=evs,
+                   passthrough=passthrough, imports=imports)
 
     @property
     def mapper(self):
-        return mapper_from_conf(self.conf)
+        if self._mapper is None:
+            self._mapper = mapper_from_conf(self.conf)
+        return self._mapper
+
+    @property
+    def source(self):
+        """The source buffer the stylesheet's events refer to."""
+        return self._evs.source if self._evs is not None else None
 
     @property
     def output_fname(self):
         return self.conf.get_css_out(self.fname)
 
-    def map_sprites(self):
-        with self.open_parser() as p:
-            srefs = find_sprite_refs(p, conf=self.conf, source=self.fname)
-            def test_sref(sref):
-                if not access(str(sref), R_OK):
-                    logger.error("%s: not readable", sref); return False
-                else:
-                    logger.debug("%s passed", sref); return True
-            return self.mapper.map_reduced(ifilter(test_sref, srefs))
-
-class InMemoryCSSFile(CSSFile):
-    def __init__(self, *a, **k):
-        sup = super(InMemoryCSSFile, self)
-        sup.__init__(*a, **k)
-        with sup.open_parser() as p:
-            self._evs = list(p)
+    def map_sprites(self, index=None):
+        """Map the readable sprites referenced, as per *index*, a
+        `FileIndex` that may be shared between stylesheets.
+        """
+        if index is None:
+            index = FileIndex()
+        def test_sref(sref):
+            if not index.readable(str(sref)):
+                logger.error("%s: not readable", sref); return False
+            else:
+                logger.debug("%s passed", sref); return True
+        return self.mapper.map_reduced(ifilter(test_sref, self.srefs))
 
-    @contextmanager
-    def open_parser(self):
-        yield self._evs
+def copy_css(src, dst, link=False):
+    """Copy *src* to *dst*, or hard-link it if *link* and possible."""
+    if link:
+        if path.exists(dst):
+            os.unlink(dst)
+        try:
+            os.link(src, dst)
+        except OSError, e:
+            logger.debug("cannot link %s to %s, copying: %s", src, dst, e)
+        else:
+            return
+    shutil.copyfile(src, dst)
+
+def _open_css_job(args):
+    (fname, conf, mmap, cache, follow_imports) = args
+    css = CSSFile.open_file(fname, conf=conf, mmap=mmap, cache=cache,
+                            follow_imports=follow_imports)
+    return css.to_result()
+
+def open_css_files(fnames, conf=None, mmap=False, jobs=1, cache=None):
+    """Open and parse stylesheets *fnames*, in *jobs* worker processes if
+    more than one. Results come back in the order of *fnames* either way.
+
+    Each worker parses a whole file, except for large files, which are
+    split up so that their parts are parsed in parallel.
+    """
+    if jobs <= 1:
+        return _open_css_files(fnames, conf=conf, mmap=mmap, cache=cache)
+    pool = Pool(jobs)
+    try:
+        return _open_css_files(fnames, conf=conf, mmap=mmap, pool=pool,
+                               cache=cache)
+    finally:
+        pool.close()
+        pool.join()
+
+def _open_css_files(fnames, conf=None, mmap=False, pool=None, cache=None,
+                    follow_imports=False):
+    if pool is None:
+        return [CSSFile.open_file(fn, conf=conf, mmap=mmap, cache=cache,
+                                  follow_imports=follow_imports)
+                for fn in fnames]
+    large = set(fn for fn in fnames if path.getsize(fn) >= 2 * segment_size)
+    small = [fn for fn in fnames if fn not in large]
+    results = pool.map_async(_open_css_job,
+                             [(fn, conf, mmap, cache, follow_imports)
+                              for fn in small])
+    opened = dict((fn, CSSFile.open_file(fn, conf=conf, mmap=mmap,
+                                         pool=pool, cache=cache,
+                                         follow_imports=follow_imports))
+                  for fn in large)
+    for result in results.get():
+        opened[result[0]] = CSSFile.from_result(result, mmap=mmap)
+    return [opened[fn] for fn in fnames]
 
-def spritemap(css_fs, conf=None, out=sys.stderr):
+def open_css_graph(fnames, conf=None, mmap=False, jobs=1, cache=None):
+    """Open stylesheets *fnames* and every stylesheet they import, directly
+    or not, like `open_css_files`. Each stylesheet is parsed once however
+    often it's imported; those imported by the same round of stylesheets
+    are parsed in parallel. Imported stylesheets come after *fnames*.
+    """
+    pool = Pool(jobs) if jobs > 1 else None
+    seen = set()
+    css_fs = []
+    try:
+        while fnames:
+            fresh = []
+            for fn in fnames:
+                key = path.abspath(fn)
+                if key not in seen:
+                    seen.add(key)
+                    fresh.append(fn)
+            opened = _open_css_files(fresh, conf=conf, mmap=mmap, pool=pool,
+                                     cache=cache, follow_imports=True)
+            css_fs.extend(opened)
+            fnames = [fn for css in opened for fn in css.imports]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return css_fs
+
+def spritemap(css_fs, conf=None, out=sys.stderr, verbatim=False,
+              link=False, jobs=1, sprite_cache=None, dedup=None):
     w_ln = lambda t: out.write(t + "\n")
 
     #: sum of all spritemaps used from any css files
     smaps = SpriteMapCollector(conf=conf)
+    #: which sprite files exist, gathered once for all css files
+    index = FileIndex()
 
     for css in css_fs:
+        if css.passthrough:
+            continue
         w_ln("mapping sprites in source %s" % (css.fname,))
-        for sm in smaps.collect(css.map_sprites()):
+        mapped = css.map_sprites(index)
+        for sm in smaps.collect(mapped):
             w_ln(" - %s" % (sm.fname,))
 
+    #: sprites that are the same image as another, to that other one
+    aliases = {}
+    if dedup:
+        deduped = []
+        for smap in smaps:
+            (smap, sm_aliases) = dedup_spritemap(smap, mode=dedup,
+                                                 cache=sprite_cache)
+            if sm_aliases:
+                w_ln("%d duplicate sprites in mapping %s"
+                     % (len(sm_aliases), smap.fname))
+            aliases.update(sm_aliases)
+            deduped.append(smap)
+        smaps = deduped
+
     # Weed out single-image spritemaps (these make no sense.)
     smaps = [sm for sm in smaps if len(sm) > 1]
 
     sm_plcs = []
-    for smap in smaps:
-        with open_sprites(smap, pad=conf.padding) as sprites:
-            w_ln("packing sprites in mapping %s" % (smap.fname,))
-            logger.debug("annealing %s in steps of %d",
-                         smap.fname, conf.anneal_steps)
-            packed = PackedBoxes(sprites, anneal_steps=conf.anneal_steps)
-            print_packed_size(packed)
-            sm_plcs.append((smap, packed.placements))
-
-            w_ln("writing spritemap image at %s" % (smap.fname,))
-            im = stitch(packed)
-            with open(smap.fname, "wb") as fp:
-                im.save(fp)
-
-    replacer = SpriteReplacer(sm_plcs)
+    #: decodes sprites in parallel
+    pool = Pool(jobs) if jobs > 1 and smaps else None
+    try:
+        for smap in smaps:
+            with open_sprites(smap, pad=conf.padding,
+                              cache=sprite_cache) as sprites:
+                w_ln("packing sprites in mapping %s" % (smap.fname,))
+                logger.debug("annealing %s in steps of %d",
+                             smap.fname, conf.anneal_steps)
+                packed = PackedBoxes(sprites, anneal_steps=conf.anneal_steps)
+                print_packed_size(packed)
+                sm_plcs.append((smap, packed.placements))
+
+                w_ln("writing spritemap image at %s" % (smap.fname,))
+                im = stitch(packed, pool=pool)
+                with open(smap.fname, "wb") as fp:
+                    im.save(fp)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    replacer = SpriteReplacer(sm_plcs, aliases=aliases)
     for css in css_fs:
+        if css.passthrough:
+            w_ln("copying css to %s" % (css.output_fname,))
+            copy_css(css.fname, css.output_fname, link=link)
+            continue
         w_ln("writing new css at %s" % (css.output_fname,))
-        with open(css.output_fname, "wb") as fp:
-            print_css(replacer(css), out=fp)
+        with open(css.output_fname, "wb") as fp, css.open_source() as src:
+            if verbatim:
+                splice_css(replacer(css), src, out=fp)
+            else:
+                print_css(replacer(css), out=fp)
 
 op = optparse.OptionParser()
 op.set_usage("%prog [opts] <css file(s) ...>")
@@ -106,11 +349,32 @@ op.add_option("--padding", type=int, metavar="N",
               help="keep N pixels of padding between sprites")
 op.add_option("-v", "--verbose", action="store_true",
               help="use debug logging level")
-#op.add_option("--in-memory", action="store_true",
-#              help="keep CSS parsing results in memory")
+op.add_option("--mmap", action="store_true",
+              help="map CSS files into memory instead of reading them")
+op.add_option("--verbatim", action="store_true",
+              help="copy unchanged CSS as is, only rewriting what's needed")
+op.add_option("-j", "--jobs", type=int, metavar="N", default=1,
+              help="parse CSS files and decode sprites in N worker "
+                   "processes")
+op.add_option("--cache-dir", metavar="DIR",
+              help="cache parsed CSS and decoded sprites in DIR between "
+                   "builds")
+op.add_option("--cache-size", type=int, metavar="MB", default=256,
+              help="evict old cache entries beyond MB megabytes "
+                   "(default: 256)")
+op.add_option("--follow-imports", action="store_true",
+              help="also process the stylesheets that are @import-ed, "
+                   "each once")
+op.add_option("--dedup", action="store_const", const="contents",
+              help="pack sprites with the same file contents only once")
+op.add_option("--dedup-pixels", action="store_const", const="pixels",
+              dest="dedup",
+              help="pack sprites with the same pixels only once")
+op.add_option("--hard-link", action="store_true",
+              help="hard-link CSS files without sprites to their output "
+                   "instead of copying them")
 #op.add_option("--anneal", type=int, metavar="N", default=9200,
 #              help="simulated anneal steps (default: 9200)")
-op.set_default("in_memory", False)
 op.set_default("anneal", None)
 
 def main():
@@ -121,11 +385,6 @@ def main():
     if not args:
         op.error("you must provide at least one css file")
 
-    if opts.in_memory:
-        css_cls = InMemoryCSSFile
-    else:
-        css_cls = CSSFile
-
     base = {}
 
     if opts.conf:
@@ -140,7 +399,20 @@ def main():
         base["padding"] = (opts.padding, opts.padding)
 
     conf = CSSConfig(base=base)
-    spritemap([css_cls.open_file(fn, conf=conf) for fn in args], conf=conf)
+    cache = sprite_cache = None
+    if opts.cache_dir:
+        cache = ParseCache(opts.cache_dir, max_size=opts.cache_size << 20)
+        sprite_cache = SpriteCache(opts.cache_dir, max_size=cache.max_size)
+
+    open_css = open_css_graph if opts.follow_imports else open_css_files
+    css_fs = open_css(args, conf=conf, mmap=opts.mmap, jobs=opts.jobs,
+                      cache=cache)
+    spritemap(css_fs, conf=conf, verbatim=opts.verbatim,
+              link=opts.hard_link, jobs=opts.jobs, sprite_cache=sprite_cache,
+              dedup=opts.dedup)
+    if cache is not None:
+        # one directory, so this evicts sprites as well
+        cache.evict()
 
 if __name__ == "__main__":
     main()
@@ -27,8 +27,7 @@ class BaseMapper(object):
             #这里检测position是否相同!!!
             if smap is None:
                 smap = smaps[fname] = SpriteMap(fname)
-            if sref not in smap:
-                smap.append(sref)
+            smap.add(sref)
         return smaps
 
 class OutputImageMapper(BaseMapper):
@@ -46,8 +45,28 @@ class OutputImageMapper(BaseMapper):
     def _map_sprite_ref(self, sref):
         return self.fname
 
+def _path_parts(p):
+    return path.normpath(p).split(path.sep)
+
+def _build_dir_trie(dirs):
+    """Nest dicts by the path components of *dirs*; the None key of a node
+    holds the index of the first of *dirs* that ends there.
+    """
+    root = {}
+    for (idx, dn) in enumerate(dirs):
+        node = root
+        for part in _path_parts(dn):
+            node = node.setdefault(part, {})
+        node.setdefault(None, idx)
+    return root
+
 class SpriteDirsMapper(BaseMapper):
-    """Maps sprites to spritemaps by using the sprite directory."""
+    """Maps sprites to spritemaps by using the sprite directory.
+
+    The sprite directories are kept in a trie of path components, so
+    finding the one a sprite is in takes as long as its path is deep, and
+    the result is remembered for each directory sprites are found in.
+    """
 
     def __init__(self, sprite_dirs=None, recursive=True, translate=None):
         if not sprite_dirs and not recursive:
@@ -55,6 +74,8 @@ class SpriteDirsMapper(BaseMapper):
         self.sprite_dirs = sprite_dirs
         self.recursive = recursive
         self.translate = translate
+        self._trie = _build_dir_trie(sprite_dirs or ())
+        self._dir_maps = {}
 
     @classmethod
     def from_conf(cls, conf):
@@ -66,16 +87,38 @@ class SpriteDirsMapper(BaseMapper):
         if self.sprite_dirs is None:
             return path.dirname(sref.fname)
 
-        for sdir in self.sprite_dirs:
-            prefix = path.commonprefix((sdir, path.dirname(str(sref))))
-            if prefix == sdir:
-                if self.recursive:
-                    submap = path.dirname(path.relpath(str(sref), sdir))
-                    if submap:
-                        return path.join(sdir, submap)
-                return sdir
-
-        raise LookupError
+        dn = path.dirname(str(sref))
+        try:
+            smap = self._dir_maps[dn]
+        except KeyError:
+            smap = self._dir_maps[dn] = self._map_dir(dn)
+        if smap is None:
+            raise LookupError
+        return smap
+
+    def _find_sprite_dir(self, dn):
+        """Index of the first sprite dir that is or contains *dn*, or None."""
+        node = self._trie
+        found = node.get(None)
+        for part in _path_parts(dn):
+            node = node.get(part)
+            if node is None:
+                break
+            idx = node.get(None)
+            if idx is not None and (found is None or idx < found):
+                found = idx
+        return found
+
+    def _map_dir(self, dn):
+        idx = self._find_sprite_dir(dn)
+        if idx is None:
+            return None
+        sdir = self.sprite_dirs[idx]
+        if self.recursive:
+            submap = path.relpath(dn, sdir)
+            if submap != path.curdir:
+                return path.join(sdir, submap)
+        return sdir
 
 def mapper_from_conf(conf):
     if conf.output_image:
@@ -102,6 +145,7 @@ class SpriteMapCollector(object):
         return self.smaps.get(None, SpriteMap(None, []))
 
     def collect(self, smaps):
+        """Merge *smaps* into the collected spritemaps, each sprite once."""
         for fname, smap in smaps.iteritems():
             if fname in self._maps:
                 self._maps[fname].extend(smap)
@@ -113,19 +157,15 @@ class SpriteMapCollector(object):
     def map_file(self, fname, mapper=None):
         """Convenience function to map the sprites of a given CSS file."""
         from spritecss.css import CSSParser
-        from spritecss.finder import find_sprite_refs
+        from spritecss.finder import scan_css
 
         with open(fname, "rb") as fp:
-            parser = CSSParser.read_file(fp)
-            evs = list(parser.iter_events())
-
-        conf = CSSConfig(evs, base=self.conf, fname=fname)
-        srefs = find_sprite_refs(evs, source=fname, conf=conf)
+            scanned = scan_css(CSSParser.read_file(fp), fname, base=self.conf)
 
         if mapper is None:
-            mapper = SpriteDirsMapper.from_conf(conf)
+            mapper = SpriteDirsMapper.from_conf(scanned.conf)
 
-        return self.map_sprite_refs(srefs, mapper=mapper)
+        return self.collect(mapper.map_reduced(scanned.srefs))
 
 def print_spritemaps(smaps):
     for smap in sorted(smaps, key=lambda sm: sm.fname):
@@ -1,7 +1,7 @@
 # coding=utf-8
 from contextlib import contextmanager
 
-from ..image import Image
+from ..image import Image, LazyImage, FileReader, default_reader
 from . import Rect
 
 class SpriteNode(Rect):
@@ -39,11 +39,28 @@ class SpriteNode(Rect):
         #此处fo是打开的file文件对象.fname是对象图像路径
         return cls.from_image(Image.load(fo), fname=fname, pad=pad)
 
+    @classmethod
+    def probe_file(cls, fn, fname=None, pad=(0, 0), reader=default_reader,
+                   cache=None):
+        """Size up the image at *fn* from its header alone; its pixels
+        are decoded once something asks for them.
+        """
+        im = LazyImage.probe(fn, reader=reader, cache=cache)
+        return cls.from_image(im, fname=fname or fn, pad=pad)
+
 @contextmanager
-def open_sprites(fnames, **kwds):
-    fs = [(fn, open(str(fn), "rb")) for fn in fnames]
+def open_sprites(fnames, max_open=None, **kwds):
+    """Probe sprites *fnames*, with no more than *max_open* files open at
+    once (by default, as many as `default_reader` allows.) A `SpriteCache`
+    can be given as *cache*.
+    """
+    reader = default_reader if max_open is None else FileReader(max_open)
+    sprites = []
     try:
-        yield [SpriteNode.load_file(fo, fname=fn, **kwds) for (fn, fo) in fs]
+        for fn in fnames:
+            sprites.append(SpriteNode.probe_file(str(fn), fname=fn,
+                                                 reader=reader, **kwds))
+        yield sprites
     finally:
-        for fn, fo in fs:
-            fo.close()
+        for sprite in sprites:
+            sprite.close()
@@ -4,7 +4,7 @@
 import logging
 
 from . import SpriteRef
-from .css import split_declaration
+from .css.parser import Declaration
 from .finder import NoSpriteFound, get_background_url , _replace_sref_val, _bg_num_position, _bg_positioned
 
 logger = logging.getLogger(__name__)
@@ -15,9 +15,38 @@ def _build_pos_map(smap, placements):
 
 
 class SpriteReplacer(object):
-    def __init__(self, spritemaps):
+    def __init__(self, spritemaps, aliases=None):
+        """*aliases* maps sprites left out of the spritemaps, being the same
+        image as another, to that other sprite; they are placed where it is.
+        """
         self._smaps = dict((sm.fname, _build_pos_map(sm, plcs))
                            for (sm, plcs) in spritemaps)
+        if aliases:
+            for pos_map in self._smaps.itervalues():
+                for (sref, first) in aliases.iteritems():
+                    if first in pos_map:
+                        pos_map[sref] = pos_map[first]
+        #: per stylesheet, background url => new background value or None
+        self._tables = {}
+
+    def _resolve(self, css, url):
+        """New background value for *url* in stylesheet *css*, or None if
+        its sprite isn't in any spritemap. Worked out once per url.
+        """
+        table = self._tables.get(css.fname)
+        if table is None:
+            table = self._tables[css.fname] = {}
+        try:
+            return table[url]
+        except KeyError:
+            sref = SpriteRef(css.conf.normpath(url), source=css.fname,
+                             position=[])
+            try:
+                new = self._replace_val(css, sref)
+            except KeyError:
+                new = None
+            table[url] = new
+            return new
 
     def __call__(self, css):
         group_background = ""
@@ -26,9 +55,7 @@ class SpriteReplacer(object):
             for ev in p:
                 if ev.lexeme == "declaration":
                     ev = self._replace_ev(css, ev , group_background)
-                    (declaration_name,declaration_value) =  split_declaration(ev.declaration)
-                    if declaration_name in target_prop:
-                        ev.declaration =  ev.declaration
+                    if ev.prop in target_prop:
                         group_background = ev.declaration
                         onlybackground = ev
                     else:
@@ -44,28 +71,27 @@ class SpriteReplacer(object):
                     yield ev
 
     def _replace_ev(self, css, ev ,group_background):
-        (prop, val) = split_declaration(ev.declaration)
+        (prop, val) = ev.split()
         if prop.strip() in target_prop:
             try:
                 url = get_background_url(val)
             except NoSpriteFound:
                  pass
             else:
-                sref = SpriteRef(css.conf.normpath(url), source=css.fname , position = [])
-                try:
-                    new = self._replace_val(css, ev, sref)
-                except KeyError:
+                new = self._resolve(css, url)
+                if new is None:
                     new = val
-                ev.declaration = "background: %s" % (new)
+                ev = Declaration(declaration="background: %s" % (new),
+                                 line_no=ev.line_no)
         elif prop == "background-position" and group_background:
             newPos = _bg_num_position(val,True)
             oldpos = _bg_num_position(group_background)
             newVal = group_background.replace(str(oldpos[0]),str(oldpos[0]+newPos[0]))
             newVal = newVal.replace(str(oldpos[1]),str(oldpos[1]+newPos[1]))
-            ev.declaration = newVal
+            ev = Declaration(declaration=newVal, line_no=ev.line_no)
         return ev
 
-    def _replace_val(self, css, ev, sref):
+    def _replace_val(self, css, sref):
         sm_fn = css.mapper(sref) #配置参数
         #计算出来的位置 sm_fn是不同CSS文件集合成不同Sprite
         #这里生成的dict是用SpriteRef来作为key值的
@@ -77,8 +103,8 @@ class SpriteReplacer(object):
 
         sm_url = css.conf.get_spritemap_url(sm_fn)
         sm_url = sm_url.replace('\\','/')
-        logger.debug("replace bg %s at L%d with spritemap %s at %s",
-                     sref, ev.state.token.line_no, sm_url, pos)
+        logger.debug("replace bg %s in %s with spritemap %s at %s",
+                     sref, css.fname, sm_url, pos)
 
         parts = ["url('%s')" % (sm_url,), "no-repeat"]
         for r in newpos:
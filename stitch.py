@@ -3,7 +3,7 @@
 from array import array
 from itertools import izip, chain, repeat
 
-from .image import Image
+from .image import Image, decode_images
 
 class StitchedSpriteNodes(object):
     """An iterable that yields the image data rows of a tree of sprite
@@ -56,9 +56,14 @@ class StitchedSpriteNodes(object):
         else:
             return self.iter_empty_rows(n)
 
-def stitch(packed, mode="RGBA", reusable=False):
+def stitch(packed, mode="RGBA", reusable=False, pool=None):
+    """Stitch the sprites of *packed* together into one image, decoding
+    them on the worker *pool* first if given.
+    """
     assert mode == "RGBA"  # TODO Support other modes than RGBA
     root = packed.tree
+    if pool is not None:
+        decode_images([sn.im for (pos, sn) in packed.placements], pool)
     bd = max(sn.im.bitdepth for (pos, sn) in packed.placements)
     meta = {"bitdepth": bd, "alpha": True}
     planes = 3 + int(meta["alpha"])